@@ -3,6 +3,8 @@ import time
 import os
 import sys
 
+from serial_reader import read_available
+
 try:
     from crsf_parser import CRSFParser
 except ImportError:
@@ -21,7 +23,8 @@ class EdgeTXMonitor:
         self.parser = CRSFParser(self.handle_frame)
         
         try:
-            self.ser = serial.Serial(port, baudrate, timeout=0.01)
+            # read_available waits up to the timeout, which also paces display()
+            self.ser = serial.Serial(port, baudrate, timeout=0.1)
             print(f"✓ Opened {port} at {baudrate} baud")
         except serial.SerialException as e:
             print(f"✗ Error opening {port}: {e}")
@@ -111,9 +114,9 @@ class EdgeTXMonitor:
         
         try:
             while True:
-                # Read available data
-                if self.ser.in_waiting > 0:
-                    data = self.ser.read(self.ser.in_waiting)
+                # Wait for data without spinning, then take everything buffered
+                data = read_available(self.ser)
+                if data:
                     
                     # Feed data to parser byte by byte
                     # The parser will call our handle_frame callback when a complete frame is received
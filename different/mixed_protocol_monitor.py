@@ -3,6 +3,8 @@ import time
 import os
 import sys
 
+from serial_reader import read_available
+
 class MixedProtocolMonitor:
     """Monitor that handles multiple RC protocols"""
     
@@ -24,7 +26,8 @@ class MixedProtocolMonitor:
             self.baudrate = self.auto_detect_baudrate()
         
         try:
-            self.ser = serial.Serial(self.port, self.baudrate, timeout=0.01)
+            # read_available waits up to the timeout, which also paces display()
+            self.ser = serial.Serial(self.port, self.baudrate, timeout=0.1)
             print(f"✓ Opened {self.port} at {self.baudrate} baud")
         except serial.SerialException as e:
             print(f"✗ Error: {e}")
@@ -123,8 +126,8 @@ class MixedProtocolMonitor:
     
     def process_data(self):
         """Process incoming data and try to parse frames"""
-        if self.ser.in_waiting > 0:
-            new_data = self.ser.read(self.ser.in_waiting)
+        new_data = read_available(self.ser)
+        if new_data:
             self.buffer.extend(new_data)
             
             # Try to find and parse frames
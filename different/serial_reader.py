@@ -0,0 +1,15 @@
+def read_available(ser, max_size=4096):
+    """Wait for data like a blocking read, then return everything buffered
+
+    Blocks until at least one byte arrives or ser.timeout expires (b'' on
+    timeout). The wait happens inside pyserial - select() on POSIX,
+    overlapped I/O on Windows - so an idle link uses no CPU and bytes are
+    returned as soon as they arrive. Open the port with a timeout: None
+    waits forever and 0 turns this back into polling.
+    """
+    data = ser.read(min(max(1, ser.in_waiting), max_size))
+    # The wait returns on the first byte; pick up the rest of the burst too
+    waiting = ser.in_waiting
+    if data and waiting and len(data) < max_size:
+        data += ser.read(min(waiting, max_size - len(data)))
+    return data
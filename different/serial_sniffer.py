@@ -3,6 +3,8 @@ import serial.tools.list_ports
 import time
 import sys
 
+from serial_reader import read_available
+
 def list_com_ports():
     """List all available COM ports"""
     ports = serial.tools.list_ports.comports()
@@ -23,9 +25,8 @@ def try_baudrate(port, baudrate, duration=3):
         bytes_received = 0
         
         while time.time() - start_time < duration:
-            if ser.in_waiting > 0:
-                data = ser.read(ser.in_waiting)
-                bytes_received += len(data)
+            data = read_available(ser)
+            bytes_received += len(data)
         
         ser.close()
         
@@ -62,8 +63,8 @@ def sniff_serial_data(port, baudrate, timeout=2):
         no_data_warning_shown = False
         
         while True:
-            if ser.in_waiting > 0:
-                data = ser.read(ser.in_waiting)
+            data = read_available(ser)
+            if data:
                 bytes_received += len(data)
                 last_data_time = time.time()
                 no_data_warning_shown = False
@@ -104,8 +105,6 @@ def sniff_serial_data(port, baudrate, timeout=2):
                 no_data_warning_shown = True
                 last_data_time = time.time()
             
-            time.sleep(0.01)
-            
     except serial.SerialException as e:
         print(f"✗ Error: {e}")
         sys.exit(1)
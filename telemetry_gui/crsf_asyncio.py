@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+import argparse
+import asyncio
+import os
+
+import serial
+
+from crsf_parser import CrsfDeframer, cachedChannelsPacket, handleCrsfPacket, packet_log
+
+__all__ = [
+    'SerialTransport',
+    'CrsfProtocol',
+    'create_serial_connection',
+    'open_crsf_link'
+]
+
+class SerialTransport(asyncio.Transport):
+    """Event loop transport over a serial port fd (loop.add_reader, POSIX only)"""
+    max_size = 4096
+
+    def __init__(self, loop, ser, protocol):
+        super().__init__()
+        self._loop = loop
+        self._ser = ser
+        self._fd = ser.fileno()
+        self._protocol = protocol
+        self._buffered = isinstance(protocol, asyncio.BufferedProtocol)
+        self._write_buffer = bytearray()
+        self._closing = False
+        self._reading = True
+        loop.call_soon(protocol.connection_made, self)
+        loop.call_soon(loop.add_reader, self._fd, self._read_ready)
+
+    def _read_ready(self):
+        try:
+            if self._buffered:
+                n = os.readv(self._fd, [self._protocol.get_buffer(-1)])
+            else:
+                data = os.read(self._fd, self.max_size)
+                n = len(data)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError as exc:
+            self._fatal_error(exc)
+            return
+        if not n:
+            # Port went away (USB unplugged, pty closed)
+            self.close()
+        elif self._buffered:
+            self._protocol.buffer_updated(n)
+        else:
+            self._protocol.data_received(data)
+
+    def write(self, data):
+        if self._closing:
+            raise RuntimeError('transport is closing')
+        if not self._write_buffer:
+            try:
+                n = os.write(self._fd, data)
+            except (BlockingIOError, InterruptedError):
+                n = 0
+            except OSError as exc:
+                self._fatal_error(exc)
+                return
+            if n == len(data):
+                return
+            data = memoryview(data)[n:]
+            self._loop.add_writer(self._fd, self._write_ready)
+        self._write_buffer += data
+
+    def _write_ready(self):
+        try:
+            n = os.write(self._fd, self._write_buffer)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError as exc:
+            self._fatal_error(exc)
+            return
+        del self._write_buffer[:n]
+        if not self._write_buffer:
+            self._loop.remove_writer(self._fd)
+            if self._closing:
+                self._loop.call_soon(self._call_connection_lost, None)
+
+    def get_write_buffer_size(self):
+        return len(self._write_buffer)
+
+    def get_extra_info(self, name, default=None):
+        if name == 'serial':
+            return self._ser
+        return default
+
+    def is_reading(self):
+        return self._reading and not self._closing
+
+    def pause_reading(self):
+        if self.is_reading():
+            self._reading = False
+            self._loop.remove_reader(self._fd)
+
+    def resume_reading(self):
+        if not self._reading and not self._closing:
+            self._reading = True
+            self._loop.add_reader(self._fd, self._read_ready)
+
+    def is_closing(self):
+        return self._closing
+
+    def close(self):
+        if self._closing:
+            return
+        self._closing = True
+        self._loop.remove_reader(self._fd)
+        if not self._write_buffer:
+            self._loop.call_soon(self._call_connection_lost, None)
+
+    def abort(self):
+        self._write_buffer.clear()
+        self._loop.remove_writer(self._fd)
+        self.close()
+
+    def _fatal_error(self, exc):
+        self._write_buffer.clear()
+        self._loop.remove_writer(self._fd)
+        if not self._closing:
+            self._closing = True
+            self._loop.remove_reader(self._fd)
+            self._loop.call_soon(self._call_connection_lost, exc)
+
+    def _call_connection_lost(self, exc):
+        try:
+            self._protocol.connection_lost(exc)
+        finally:
+            self._ser.close()
+
+class CrsfProtocol(asyncio.BufferedProtocol):
+    """Deframes a CRSF link; frames go to on_frame or an async iterator"""
+
+    def __init__(self, on_frame=None, maxsize=1024):
+        # on_frame(ptype, frame) gets a memoryview valid only during the call.
+        # Without it, (ptype, bytes) pairs are queued for `async for`; when
+        # the consumer falls maxsize frames behind, new frames are dropped.
+        self.deframer = CrsfDeframer(resync=True)
+        self.on_frame = on_frame
+        self.transport = None
+        self.dropped = 0
+        self._queue = asyncio.Queue(maxsize) if on_frame is None else None
+        # Resolves with the connection_lost exception (None on a clean close)
+        self.closed = asyncio.get_running_loop().create_future()
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def get_buffer(self, sizehint):
+        return self.deframer.get_buffer()
+
+    def buffer_updated(self, nbytes):
+        self.deframer.buffer_updated(nbytes)
+        for frame in self.deframer.frames():
+            if self.on_frame is not None:
+                self.on_frame(frame[2], frame)
+            else:
+                try:
+                    self._queue.put_nowait((frame[2], bytes(frame)))
+                except asyncio.QueueFull:
+                    self.dropped += 1
+
+    def connection_lost(self, exc):
+        if not self.closed.done():
+            self.closed.set_result(exc)
+        if self._queue is not None:
+            if self._queue.full():
+                self._queue.get_nowait()
+                self.dropped += 1
+            self._queue.put_nowait(None)
+
+    def send_channels(self, channels):
+        self.transport.write(cachedChannelsPacket(channels))
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        item = await self._queue.get()
+        if item is None:
+            # Keep the end marker for any other waiting consumer
+            self._queue.put_nowait(None)
+            raise StopAsyncIteration
+        return item
+
+async def create_serial_connection(loop, protocol_factory, port, baudrate, **kwargs):
+    # Like loop.create_connection, for a serial port; kwargs go to serial.Serial
+    ser = serial.Serial(port, baudrate, timeout=0, **kwargs)
+    protocol = protocol_factory()
+    transport = SerialTransport(loop, ser, protocol)
+    return transport, protocol
+
+async def open_crsf_link(port, baudrate=921600, on_frame=None, maxsize=1024):
+    loop = asyncio.get_running_loop()
+    return await create_serial_connection(
+        loop, lambda: CrsfProtocol(on_frame, maxsize), port, baudrate)
+
+async def monitor(ports, baudrate):
+    # One loop, every link: each frame goes through the CLI handlers
+    links = [await open_crsf_link(port, baudrate, on_frame=handleCrsfPacket) for port in ports]
+    await asyncio.gather(*(protocol.closed for transport, protocol in links))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-P', '--port', action='append', required=True,
+                    help='Serial port to monitor (repeat for several links)')
+    parser.add_argument('-b', '--baud', type=int, default=921600, required=False)
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(monitor(args.port, args.baud))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        packet_log.close()
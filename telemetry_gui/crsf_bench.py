@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import timeit
+
+from crsf_parser import (
+    np,
+    PacketsTypes,
+    crc8_data,
+    crsf_validate_frame,
+    crsf_frame,
+    CrsfDeframer,
+    packCrsfToBytes,
+    channelsCrsfToChannelsPacket,
+    cachedChannelsPacket,
+    unpackCrsfFromBytes,
+    channelsPacketsToCrsfArray,
+    LINK_STATISTICS_STRUCT,
+    ATTITUDE_STRUCT,
+    BATTERY_SENSOR_STRUCT,
+    GPS_STRUCT,
+    VARIO_STRUCT,
+    PAYLOAD_DECODERS,
+    RECORD_TYPES,
+)
+
+def crc8_dvb_s2_loop(crc, a) -> int:
+    # The original bit-at-a-time implementation, kept as the baseline
+    crc = crc ^ a
+    for ii in range(8):
+        if crc & 0x80:
+            crc = (crc << 1) ^ 0xD5
+        else:
+            crc = crc << 1
+    return crc & 0xFF
+
+def crc8_data_loop(data) -> int:
+    crc = 0
+    for a in data:
+        crc = crc8_dvb_s2_loop(crc, a)
+    return crc
+
+# One representative frame per decoded type
+CHANNELS = [172, 992, 1811, 992, 1500, 1000, 2000, 172] * 2
+SAMPLE_FRAMES = {
+    PacketsTypes.LINK_STATISTICS: crsf_frame(PacketsTypes.LINK_STATISTICS,
+        LINK_STATISTICS_STRUCT.pack(-60, -62, 100, 10, 0, 4, 3, -58, 100, 9)),
+    PacketsTypes.ATTITUDE: crsf_frame(PacketsTypes.ATTITUDE, ATTITUDE_STRUCT.pack(1000, -2000, 15000)),
+    PacketsTypes.BATTERY_SENSOR: crsf_frame(PacketsTypes.BATTERY_SENSOR,
+        BATTERY_SENSOR_STRUCT.pack(168, 52, 0, 1234, 75)),
+    PacketsTypes.GPS: crsf_frame(PacketsTypes.GPS, GPS_STRUCT.pack(473977000, 85456000, 360, 18000, 1500, 12)),
+    PacketsTypes.VARIO: crsf_frame(PacketsTypes.VARIO, VARIO_STRUCT.pack(-15)),
+    PacketsTypes.FLIGHT_MODE: crsf_frame(PacketsTypes.FLIGHT_MODE, b'ACRO\x00'),
+    PacketsTypes.RC_CHANNELS_PACKED: channelsCrsfToChannelsPacket(CHANNELS),
+}
+
+results = []
+
+def bench(label, fn, number, frames=1):
+    # frames: CRSF frames handled per call, for the frames/s column
+    seconds = min(timeit.repeat(fn, number=number, repeat=5))
+    ns_per_op = seconds / number * 1e9
+    frames_per_sec = frames * 1e9 / ns_per_op
+    print(f"{label:<40} {ns_per_op:10.0f} ns/op {frames_per_sec:12.0f} frames/s")
+    results.append({'name': label, 'ns_per_op': ns_per_op, 'frames_per_sec': frames_per_sec,
+                    'number': number, 'frames': frames})
+    return ns_per_op
+
+def bench_crc(number):
+    frame = SAMPLE_FRAMES[PacketsTypes.RC_CHANNELS_PACKED]
+    if crc8_data_loop(frame[2:-1]) != crc8_data(frame, 2, len(frame) - 1):
+        raise RuntimeError('table CRC does not match the bit loop')
+
+    print(f"CRC over a {len(frame)}-byte RC_CHANNELS_PACKED frame")
+    old = bench('crc8 bit loop (frame[2:-1])', lambda: crc8_data_loop(frame[2:-1]), number)
+    new = bench('crc8 table (range, no slice)', lambda: crc8_data(frame, 2, len(frame) - 1), number)
+    bench('crsf_validate_frame', lambda: crsf_validate_frame(frame), number)
+    print(f"speedup: {old / new:.1f}x")
+
+def bench_deframe(number):
+    # 100 frames cycling through every sample type, fed as one read
+    frames = list(SAMPLE_FRAMES.values())
+    stream = b''.join(frames[i % len(frames)] for i in range(100))
+    # Same frames with a stray byte and a corrupted frame every tenth frame
+    noisy = bytearray()
+    for i in range(100):
+        frame = bytearray(frames[i % len(frames)])
+        if i % 10 == 9:
+            noisy.append(0x55)
+            frame[-1] ^= 0xFF
+        noisy += frame
+    noisy = bytes(noisy)
+
+    print(f"Deframing 100 frames ({len(stream)} bytes) per call")
+    deframer = CrsfDeframer()
+    def deframe():
+        deframer.feed(stream)
+        for frame in deframer.frames():
+            pass
+    bench('CrsfDeframer feed + frames', deframe, max(1, number // 100), 100)
+
+    resync = CrsfDeframer(resync=True)
+    def deframe_noisy():
+        resync.feed(noisy)
+        for frame in resync.frames():
+            pass
+    bench('CrsfDeframer resync, 10% bad frames', deframe_noisy, max(1, number // 100), 90)
+
+def bench_stream(number):
+    # Ten seconds of a realistic link from crsf_gen, with bit errors,
+    # truncated frames and garbage, deframed in 4 KiB reads
+    from crsf_gen import StreamGenerator
+    generator = StreamGenerator(seed=1, ber=1e-5, truncate=0.001, garbage=0.001)
+    stream = generator.generate(10)
+    chunks = [stream[i:i + 4096] for i in range(0, len(stream), 4096)]
+    frames = sum(generator.counts.values()) - generator.corrupted - generator.truncated
+
+    print(f"Deframing a generated 10 s stream ({len(stream)} bytes, ~{frames} valid frames)")
+    def deframe():
+        deframer = CrsfDeframer(resync=True)
+        for chunk in chunks:
+            while chunk:
+                chunk = chunk[deframer.feed(chunk):]
+                for frame in deframer.frames():
+                    pass
+    bench('CrsfDeframer resync, generated stream', deframe, max(1, number // 20000), frames)
+
+def bench_decode(number):
+    print('Decoders (filling a reused record)')
+    for ptype, decoder in PAYLOAD_DECODERS.items():
+        frame = SAMPLE_FRAMES[ptype]
+        out = RECORD_TYPES[ptype]()
+        bench(f"decode {PacketsTypes(ptype).name}", lambda: decoder(frame, out), number)
+    frame = SAMPLE_FRAMES[PacketsTypes.RC_CHANNELS_PACKED]
+    bench('unpackCrsfFromBytes', lambda: unpackCrsfFromBytes(frame, 3), number)
+    if np is not None:
+        batch = np.frombuffer(frame * 1000, dtype=np.uint8).reshape(1000, len(frame))
+        bench('channelsPacketsToCrsfArray (1000 frames)', lambda: channelsPacketsToCrsfArray(batch),
+              max(1, number // 100), 1000)
+
+def bench_encode(number):
+    print('Encoders')
+    bench('packCrsfToBytes', lambda: packCrsfToBytes(CHANNELS), number)
+    bench('channelsCrsfToChannelsPacket', lambda: channelsCrsfToChannelsPacket(CHANNELS), number)
+    bench('cachedChannelsPacket (hit)', lambda: cachedChannelsPacket(CHANNELS), number)
+
+def load_mixed_protocol_monitor():
+    # different/ is a folder of scripts, not a package: load the module by
+    # path, with different/ on sys.path for its own serial_reader import
+    directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'different')
+    if directory not in sys.path:
+        sys.path.append(directory)
+    spec = importlib.util.spec_from_file_location(
+        'mixed_protocol_monitor', os.path.join(directory, 'mixed_protocol_monitor.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.MixedProtocolMonitor
+
+def bench_mixed(number):
+    print('MixedProtocolMonitor parsers (different/mixed_protocol_monitor.py)')
+    try:
+        cls = load_mixed_protocol_monitor()
+    except (ImportError, OSError) as e:
+        print(f"skipped: {e}")
+        return
+    # Skip __init__, which opens the serial port; the parsers only set
+    # channels and protocol_detected
+    monitor = cls.__new__(cls)
+    monitor.channels = [1500] * 16
+    monitor.protocol_detected = None
+    sbus = bytes([0x0F]) + packCrsfToBytes(CHANNELS) + bytes([0x00, 0x00])
+    crsf = SAMPLE_FRAMES[PacketsTypes.RC_CHANNELS_PACKED]
+    if not monitor.parse_sbus(sbus) or not monitor.parse_crsf(crsf):
+        raise RuntimeError('MixedProtocolMonitor rejected the sample frames')
+    bench('MixedProtocolMonitor.parse_sbus', lambda: monitor.parse_sbus(sbus), max(1, number // 10))
+    bench('MixedProtocolMonitor.parse_crsf', lambda: monitor.parse_crsf(crsf), max(1, number // 10))
+
+SUITES = {
+    'crc': bench_crc,
+    'deframe': bench_deframe,
+    'stream': bench_stream,
+    'decode': bench_decode,
+    'encode': bench_encode,
+    'mixed': bench_mixed,
+}
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def compare(path):
+    # Ratio against an earlier --json run: > 1 means this run is faster
+    with open(path) as f:
+        previous = {r['name']: r for r in json.load(f)['results']}
+    print(f"\nCompared with {path}")
+    for r in results:
+        old = previous.get(r['name'])
+        if old is not None:
+            print(f"{r['name']:<40} {old['ns_per_op']:10.0f} -> {r['ns_per_op']:10.0f} ns/op "
+                  f"{old['ns_per_op'] / r['ns_per_op']:6.2f}x")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--number', type=int, default=20000)
+    parser.add_argument('-s', '--suite', action='append', choices=list(SUITES),
+                    help='Run only this suite (repeatable); default all')
+    parser.add_argument('-j', '--json', metavar='FILE',
+                    help='Write results to FILE as JSON')
+    parser.add_argument('-c', '--compare', metavar='FILE',
+                    help='Compare with the results of an earlier --json run')
+    args = parser.parse_args()
+
+    for name in args.suite or SUITES:
+        SUITES[name](args.number)
+        print()
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({
+                'revision': git_revision(),
+                'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                'python': sys.version.split()[0],
+                'implementation': platform.python_implementation(),
+                'machine': platform.machine(),
+                'numpy': np.__version__ if np is not None else None,
+                'number': args.number,
+                'results': results,
+            }, f, indent=2)
+        print(f"Wrote {args.json}")
+    if args.compare:
+        compare(args.compare)
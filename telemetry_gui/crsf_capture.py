@@ -0,0 +1,367 @@
+#!/usr/bin/env python3
+import argparse
+import mmap
+import os
+import queue
+import struct
+import threading
+import time
+from array import array
+from bisect import bisect_left
+
+__all__ = [
+    'CAPTURE_MAGIC',
+    'HEADER',
+    'RECORD',
+    'KIND_FRAME',
+    'KIND_RAW',
+    'KIND_LINK',
+    'CaptureWriter',
+    'CaptureReader'
+]
+
+# Capture file layout (little-endian):
+#   header: magic, version, flags (0), wall clock ns and monotonic ns at
+#           open, so record timestamps can be turned into wall time
+#   record: monotonic ns timestamp, link number, kind, length, then
+#           `length` bytes of data
+CAPTURE_MAGIC = b'CRSFCAP\x00'
+CAPTURE_VERSION = 1
+HEADER = struct.Struct('<8sHHqq')
+RECORD = struct.Struct('<qBBH')
+
+KIND_FRAME = 0  # one complete, CRC-valid CRSF frame
+KIND_RAW = 1    # bytes exactly as read from the port, before deframing
+KIND_LINK = 2   # names a link number; data is the UTF-8 link id
+
+# Sidecar index (<capture>.idx): magic, version, size and header wall/
+# monotonic clocks of the capture it was built from (a re-recording of the
+# same length has different clocks), record and link counts, then
+# native-order int64 arrays of record offsets, running-max timestamps and
+# link record offsets
+INDEX_MAGIC = b'CRSFIDX\x00'
+INDEX_VERSION = 2
+INDEX_HEADER = struct.Struct('<8sHqqqqq')
+
+class CaptureWriter:
+    """Append-only capture file, written in large blocks by a background thread"""
+
+    def __init__(self, path, block_size=256 * 1024):
+        self.path = path
+        self.block_size = block_size
+        self.records = 0
+        # First write error from the background thread; raised by flush()
+        # and close(), and everything after it is discarded
+        self.error = None
+        self.file = open(path, 'wb')
+        self._buffer = bytearray(HEADER.pack(CAPTURE_MAGIC, CAPTURE_VERSION, 0,
+                                             time.time_ns(), time.monotonic_ns()))
+        self._links = {}
+        self._lock = threading.RLock()
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='CaptureWriter', daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _run(self):
+        # Disk writes happen here so a slow disk never stalls the read loop.
+        # After a write error (disk full) blocks are still taken off the
+        # queue, so flush() and close() return instead of waiting forever
+        while True:
+            block = self._queue.get()
+            try:
+                if block is None:
+                    break
+                if self.error is None:
+                    self.file.write(block)
+            except OSError as e:
+                self.error = e
+            finally:
+                self._queue.task_done()
+
+    def _append(self, timestamp_ns, link, kind, data):
+        with self._lock:
+            buf = self._buffer
+            buf += RECORD.pack(timestamp_ns, link, kind, len(data))
+            buf += data
+            self.records += 1
+            if len(buf) >= self.block_size:
+                self._queue.put(buf)
+                self._buffer = bytearray()
+
+    def link(self, link_id) -> int:
+        # Record number for a link id (string or int), announced on first use
+        with self._lock:
+            number = self._links.get(link_id)
+            if number is None:
+                number = len(self._links)
+                if number > 255:
+                    raise ValueError('a capture holds at most 256 links')
+                self._links[link_id] = number
+                self._append(time.monotonic_ns(), number, KIND_LINK, str(link_id).encode('utf-8'))
+            return number
+
+    def write_frame(self, frame, link=0, timestamp_ns=None):
+        self._append(timestamp_ns or time.monotonic_ns(), link, KIND_FRAME, frame)
+
+    def write_raw(self, data, link=0, timestamp_ns=None):
+        # Chunks above 64 KiB are split to fit the 16-bit length
+        for start in range(0, len(data), 0xFFFF):
+            self._append(timestamp_ns or time.monotonic_ns(), link, KIND_RAW,
+                         data[start:start + 0xFFFF])
+
+    def raw_sink(self, link=0):
+        # Callable for CrsfDeframer(on_data=...)
+        def sink(data):
+            self.write_raw(data, link)
+        return sink
+
+    def _drain(self):
+        with self._lock:
+            if self._buffer:
+                self._queue.put(self._buffer)
+                self._buffer = bytearray()
+        # Timed wait, so a writer thread that is gone cannot block this
+        pending = self._queue
+        with pending.all_tasks_done:
+            while pending.unfinished_tasks and self._thread.is_alive():
+                pending.all_tasks_done.wait(0.1)
+        if self.error is None:
+            try:
+                self.file.flush()
+            except OSError as e:
+                self.error = e
+
+    def flush(self):
+        self._drain()
+        if self.error is not None:
+            raise self.error
+
+    def close(self):
+        # Stops the writer and closes the file even after a write error,
+        # then raises that error
+        if self.file.closed:
+            return
+        self._drain()
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        try:
+            self.file.close()
+        except OSError as e:
+            if self.error is None:
+                self.error = e
+        if self.error is not None:
+            raise self.error
+
+class CaptureReader:
+    """Memory-mapped capture file with a timestamp index for seeking"""
+
+    def __init__(self, path, sidecar=True):
+        # sidecar: load <path>.idx if it matches the file, else build the
+        # index by scanning and save it there for next time
+        self.path = path
+        self.index_path = path + '.idx'
+        self.truncated = False
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self._mmap)
+        if len(self.view) < HEADER.size:
+            self.close()
+            raise ValueError(f"{path}: too short for a capture header")
+        magic, version, flags, self.wall_ns, self.monotonic_ns = HEADER.unpack_from(self.view, 0)
+        if magic != CAPTURE_MAGIC or version != CAPTURE_VERSION:
+            self.close()
+            raise ValueError(f"{path}: not a version {CAPTURE_VERSION} capture")
+        if not (sidecar and self._load_index()):
+            self._build_index()
+            if sidecar:
+                self._save_index()
+        self.links = {}
+        for offset in self.link_offsets:
+            ts, link, kind, length = RECORD.unpack_from(self.view, offset)
+            start = offset + RECORD.size
+            self.links[link] = bytes(self.view[start:start + length]).decode('utf-8')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def _build_index(self):
+        # One pass over the record headers; data bytes are never touched.
+        # Timestamps are kept as a running maximum so they stay sorted for
+        # bisect even when several links interleave slightly out of order.
+        view = self.view
+        size = len(view)
+        offsets = array('q')
+        timestamps = array('q')
+        link_offsets = array('q')
+        unpack_from = RECORD.unpack_from
+        offset = HEADER.size
+        latest = 0
+        while offset + RECORD.size <= size:
+            ts, link, kind, length = unpack_from(view, offset)
+            end = offset + RECORD.size + length
+            if end > size:
+                break
+            if kind == KIND_LINK:
+                link_offsets.append(offset)
+            else:
+                if ts > latest:
+                    latest = ts
+                offsets.append(offset)
+                timestamps.append(latest)
+            offset = end
+        # A recorder that died mid-block leaves a partial last record
+        self.truncated = offset != size
+        self.offsets = offsets
+        self.timestamps = timestamps
+        self.link_offsets = link_offsets
+
+    def _load_index(self) -> bool:
+        try:
+            with open(self.index_path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return False
+        if len(data) < INDEX_HEADER.size:
+            return False
+        magic, version, size, wall_ns, monotonic_ns, count, links = INDEX_HEADER.unpack_from(data, 0)
+        if (magic != INDEX_MAGIC or version != INDEX_VERSION or size != len(self.view)
+                or wall_ns != self.wall_ns or monotonic_ns != self.monotonic_ns):
+            return False
+        arrays = []
+        start = INDEX_HEADER.size
+        for n in (count, count, links):
+            a = array('q')
+            a.frombytes(data[start:start + n * a.itemsize])
+            if len(a) != n:
+                return False
+            arrays.append(a)
+            start += n * a.itemsize
+        self.offsets, self.timestamps, self.link_offsets = arrays
+        if count:
+            ts, link, kind, length = RECORD.unpack_from(self.view, self.offsets[-1])
+            self.truncated = self.offsets[-1] + RECORD.size + length != size
+        return True
+
+    def _save_index(self):
+        try:
+            with open(self.index_path, 'wb') as f:
+                f.write(INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, len(self.view), self.wall_ns,
+                                          self.monotonic_ns, len(self.offsets), len(self.link_offsets)))
+                self.offsets.tofile(f)
+                self.timestamps.tofile(f)
+                self.link_offsets.tofile(f)
+        except OSError:
+            # Read-only directory: the index just gets rebuilt next time
+            pass
+
+    def time_range(self) -> tuple:
+        # (first, last) monotonic ns timestamps, or None for an empty capture
+        if not self.offsets:
+            return None
+        first = RECORD.unpack_from(self.view, self.offsets[0])[0]
+        return first, self.timestamps[-1]
+
+    def wall_time_ns(self, timestamp_ns) -> int:
+        return self.wall_ns + timestamp_ns - self.monotonic_ns
+
+    def seek(self, timestamp_ns) -> int:
+        # Index of the first record that may be at or after timestamp_ns;
+        # every record before it is earlier
+        return bisect_left(self.timestamps, timestamp_ns)
+
+    def records(self, start=0, stop=None):
+        # Yields (timestamp_ns, link, kind, data) from record index start;
+        # data is a memoryview into the mapping, so nothing is copied
+        view = self.view
+        unpack_from = RECORD.unpack_from
+        for offset in self.offsets[start:stop]:
+            ts, link, kind, length = unpack_from(view, offset)
+            offset += RECORD.size
+            yield ts, link, kind, view[offset:offset + length]
+
+    def frames(self, start_ns=None, end_ns=None):
+        # Yields (timestamp_ns, link, frame) for frames in [start_ns, end_ns).
+        # Recorded frames are views into the mapping; raw records are
+        # deframed per link and yield views into that link's CrsfDeframer,
+        # valid until the next frame. Frames carry the [addr, len, type, ...]
+        # layout the decoders and handleCrsfPacket expect.
+        start = 0 if start_ns is None else self.seek(start_ns)
+        deframers = {}
+        for ts, link, kind, data in self.records(start):
+            if end_ns is not None and ts >= end_ns:
+                break
+            if start_ns is not None and ts < start_ns:
+                continue
+            if kind == KIND_FRAME:
+                yield ts, link, data
+            elif kind == KIND_RAW:
+                deframer = deframers.get(link)
+                if deframer is None:
+                    from crsf_parser import CrsfDeframer
+                    deframer = deframers[link] = CrsfDeframer(resync=True)
+                while data:
+                    data = data[deframer.feed(data):]
+                    for frame in deframer.frames():
+                        yield ts, link, frame
+
+    def close(self):
+        # A view handed out by records()/frames() that is still alive keeps
+        # the mapping open; it is unmapped when the last one goes away
+        self.view.release()
+        try:
+            self._mmap.close()
+        except BufferError:
+            pass
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('capture', help='Capture file written with --record')
+    parser.add_argument('-s', '--start', type=float, default=None,
+                    help='Seconds from the start of the capture to begin at')
+    parser.add_argument('-e', '--end', type=float, default=None,
+                    help='Seconds from the start of the capture to stop at')
+    parser.add_argument('-D', '--decode', action='store_true',
+                    help='Run frames through the packet handlers')
+    parser.add_argument('--no-index', action='store_true',
+                    help='Do not read or write the .idx sidecar')
+    args = parser.parse_args()
+
+    from crsf_parser import PacketsTypes, handleCrsfPacket, packet_log
+
+    with CaptureReader(args.capture, sidecar=not args.no_index) as reader:
+        span = reader.time_range()
+        print(f"{args.capture}: {len(reader)} records, {os.path.getsize(args.capture)} bytes"
+              f"{', truncated' if reader.truncated else ''}")
+        for link, link_id in sorted(reader.links.items()):
+            print(f"  link {link}: {link_id}")
+        if span is not None:
+            first, last = span
+            print(f"  {(last - first) / 1e9:.3f} s from "
+                  f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(reader.wall_time_ns(first) / 1e9))}")
+            start_ns = None if args.start is None else first + int(args.start * 1e9)
+            end_ns = None if args.end is None else first + int(args.end * 1e9)
+            types = {}
+            for ts, link, frame in reader.frames(start_ns, end_ns):
+                ptype = frame[2]
+                types[ptype] = types.get(ptype, 0) + 1
+                if args.decode:
+                    handleCrsfPacket(ptype, frame)
+            # Let go of the last view into the mapping before it is closed
+            frame = None
+            packet_log.close()
+            for ptype, count in sorted(types.items()):
+                name = PacketsTypes(ptype).name if ptype in PacketsTypes._value2member_map_ else f"0x{ptype:02x}"
+                print(f"  {name}: {count}")
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+import argparse
+import csv
+import queue
+import threading
+import time
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+from crsf_parser import PacketsTypes, RECORD_TYPES, RcChannels, decode_payload
+
+__all__ = [
+    'FORMATS',
+    'record_columns',
+    'TelemetryExporter'
+]
+
+FORMATS = ('csv', 'parquet')
+
+def record_columns(ptype) -> list:
+    # (column, python type) for one frame type, from the record defaults;
+    # RC channels become ch1..ch16
+    record = RECORD_TYPES[ptype]()
+    if isinstance(record, RcChannels):
+        return [(f"ch{n}", int) for n in range(1, 17)]
+    return [(name, type(getattr(record, name))) for name in record.__slots__]
+
+def _row(record) -> tuple:
+    if isinstance(record, RcChannels):
+        return tuple(record.channels)
+    return tuple(getattr(record, name) for name in record.__slots__)
+
+class _CsvTable:
+    def __init__(self, path, columns):
+        self.file = open(path, 'w', newline='')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow([name for name, kind in columns])
+
+    def write(self, rows):
+        self.writer.writerows(rows)
+
+    def close(self):
+        self.file.close()
+
+class _ParquetTable:
+    ARROW_TYPES = {int: 'int64', float: 'float64', str: 'string'}
+
+    def __init__(self, path, columns):
+        self.names = [name for name, kind in columns]
+        self.schema = pa.schema([(name, self.ARROW_TYPES[kind]) for name, kind in columns])
+        self.writer = pq.ParquetWriter(path, self.schema)
+
+    def write(self, rows):
+        # Rows to columns; each chunk becomes one row group
+        columns = list(zip(*rows))
+        self.writer.write_table(pa.Table.from_arrays(
+            [pa.array(column, type=field.type) for column, field in zip(columns, self.schema)],
+            schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+class TelemetryExporter:
+    """Decodes frames and writes them to CSV or Parquet tables on a background thread"""
+
+    def __init__(self, path, format='csv', wide=False, chunk_rows=4096, maxsize=65536):
+        # path is a prefix: one <path>_<TYPE>.<format> table per frame type,
+        # or with wide=True a single <path>.<format> where each row is one
+        # frame plus the latest value of every other type's fields
+        if format not in FORMATS:
+            raise ValueError(f"format must be one of {FORMATS}")
+        if format == 'parquet' and pa is None:
+            raise RuntimeError('Parquet export needs pyarrow (pip install pyarrow)')
+        self.path = path
+        self.format = format
+        self.wide = wide
+        self.chunk_rows = chunk_rows
+        # Bounded: if the disk stalls long enough to fill it, frames are
+        # dropped and counted rather than blocking the serial reader
+        self.queue = queue.Queue(maxsize)
+        self.dropped = 0
+        # Frames that could not be decoded or written; the writer carries on
+        self.errors = 0
+        self.rows = {}
+        self._table_type = _CsvTable if format == 'csv' else _ParquetTable
+        self._tables = {}
+        self._chunks = {}
+        self._records = {ptype: record() for ptype, record in RECORD_TYPES.items()}
+        if wide:
+            self._wide_columns = [('timestamp_ns', int), ('type', str)]
+            self._wide_offsets = {}
+            for ptype in RECORD_TYPES:
+                prefix = PacketsTypes(ptype).name.lower()
+                self._wide_offsets[ptype] = len(self._wide_columns)
+                self._wide_columns += [(f"{prefix}_{name}", kind) for name, kind in record_columns(ptype)]
+            self._wide_row = [None] * len(self._wide_columns)
+        self._thread = threading.Thread(target=self._run, name='TelemetryExporter', daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def submit(self, ptype, frame, timestamp_ns=None):
+        # Reader thread: copies the frame and returns at once; types without
+        # a decoder are ignored. Timestamps default to wall-clock ns.
+        if ptype not in RECORD_TYPES:
+            return
+        try:
+            self.queue.put_nowait((time.time_ns() if timestamp_ns is None else timestamp_ns, ptype, bytes(frame)))
+        except queue.Full:
+            self.dropped += 1
+
+    def _table(self, key):
+        table = self._tables.get(key)
+        if table is None:
+            if self.wide:
+                columns = self._wide_columns
+                path = f"{self.path}.{self.format}"
+            else:
+                columns = [('timestamp_ns', int)] + record_columns(key)
+                path = f"{self.path}_{PacketsTypes(key).name}.{self.format}"
+            table = self._tables[key] = self._table_type(path, columns)
+            self._chunks[key] = []
+        return table
+
+    def _add(self, timestamp_ns, ptype, frame):
+        record = decode_payload(ptype, frame, self._records[ptype])
+        if record is None:
+            self.errors += 1
+            return
+        values = _row(record)
+        if self.wide:
+            key = None
+            row = self._wide_row
+            row[0] = timestamp_ns
+            row[1] = PacketsTypes(ptype).name
+            offset = self._wide_offsets[ptype]
+            row[offset:offset + len(values)] = values
+            row = tuple(row)
+        else:
+            key = ptype
+            row = (timestamp_ns,) + values
+        table = self._table(key)
+        chunk = self._chunks[key]
+        chunk.append(row)
+        self.rows[ptype] = self.rows.get(ptype, 0) + 1
+        if len(chunk) >= self.chunk_rows:
+            table.write(chunk)
+            self._chunks[key] = []
+
+    def _run(self):
+        try:
+            while True:
+                item = self.queue.get()
+                if item is None:
+                    break
+                try:
+                    self._add(*item)
+                except Exception:
+                    self.errors += 1
+        finally:
+            # Tables are always finished, or a Parquet file has no footer
+            for key, chunk in self._chunks.items():
+                if chunk:
+                    try:
+                        self._tables[key].write(chunk)
+                    except Exception:
+                        self.errors += len(chunk)
+            for table in self._tables.values():
+                table.close()
+
+    def close(self):
+        # Writes what is queued, then closes every table. The stop marker is
+        # put with a timeout so a writer that died cannot block this forever
+        thread = self._thread
+        if thread is None:
+            return
+        while thread.is_alive():
+            try:
+                self.queue.put(None, timeout=0.1)
+                break
+            except queue.Full:
+                pass
+        thread.join()
+        self._thread = None
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('capture', help='Capture file written with --record')
+    parser.add_argument('-o', '--output', required=True,
+                    help='Output prefix, e.g. flight1 -> flight1_GPS.csv')
+    parser.add_argument('-f', '--format', choices=FORMATS, default='csv')
+    parser.add_argument('--wide', action='store_true',
+                    help='One merged table instead of one per frame type')
+    args = parser.parse_args()
+
+    from crsf_capture import CaptureReader
+
+    start = time.perf_counter()
+    with CaptureReader(args.capture) as reader:
+        # Unbounded queue: reading a file, nothing to protect from stalls
+        exporter = TelemetryExporter(args.output, args.format, args.wide, maxsize=0)
+        for ts, link, frame in reader.frames():
+            exporter.submit(frame[2], frame, reader.wall_time_ns(ts))
+        # Let go of the last view into the mapping before it is closed
+        frame = None
+        exporter.close()
+    print(f"Exported in {time.perf_counter() - start:.2f} s"
+          f"{f', {exporter.errors} frames failed' if exporter.errors else ''}")
+    for ptype, count in sorted(exporter.rows.items()):
+        print(f"  {PacketsTypes(ptype).name}: {count} rows")
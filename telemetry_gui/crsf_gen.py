@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+import argparse
+import heapq
+import math
+import random
+import time
+
+from crsf_parser import (
+    PacketsTypes,
+    crc8_data,
+    CRC8_TABLE,
+    CRSF_SYNC,
+    packCrsfToBytes,
+    LINK_STATISTICS_STRUCT,
+    ATTITUDE_STRUCT,
+    BATTERY_SENSOR_STRUCT,
+    GPS_STRUCT,
+)
+
+__all__ = [
+    'TYPE_RATES',
+    'StreamGenerator'
+]
+
+# Frames per second of each type on a typical 500 Hz link
+TYPE_RATES = {
+    PacketsTypes.RC_CHANNELS_PACKED: 500,
+    PacketsTypes.LINK_STATISTICS: 10,
+    PacketsTypes.ATTITUDE: 25,
+    PacketsTypes.GPS: 5,
+    PacketsTypes.BATTERY_SENSOR: 5,
+    PacketsTypes.FLIGHT_MODE: 2,
+}
+
+FLIGHT_MODES = (b'ACRO', b'ANGLE', b'HOR', b'AIR', b'!FS!')
+
+class StreamGenerator:
+    """Seeded synthetic CRSF byte stream with a realistic type mix and injected faults"""
+
+    def __init__(self, seed=0, rates=None, ber=0.0, truncate=0.0, garbage=0.0, garbage_len=64):
+        # ber: probability of each bit being flipped; truncate: probability a
+        # frame is cut short; garbage: probability a run of 1..garbage_len
+        # random bytes is inserted before a frame
+        self.random = random.Random(seed)
+        self.rates = dict(TYPE_RATES if rates is None else rates)
+        self.ber = ber
+        self.truncate = truncate
+        self.garbage = garbage
+        self.garbage_len = garbage_len
+        self.builders = {
+            PacketsTypes.RC_CHANNELS_PACKED: self._rc_channels,
+            PacketsTypes.LINK_STATISTICS: self._link_statistics,
+            PacketsTypes.ATTITUDE: self._attitude,
+            PacketsTypes.GPS: self._gps,
+            PacketsTypes.BATTERY_SENSOR: self._battery_sensor,
+            PacketsTypes.FLIGHT_MODE: self._flight_mode,
+        }
+        self.counts = {ptype: 0 for ptype in self.rates}
+        self.corrupted = 0
+        self.truncated = 0
+        self.garbage_bytes = 0
+        self.bit_errors = 0
+        self._next_error = self._error_gap()
+
+    # Payloads follow a smooth flight so decoded values look plausible;
+    # t is seconds since the start of the stream
+
+    def _rc_channels(self, t):
+        sticks = [992 + int(800 * math.sin(t * (0.5 + 0.25 * i))) for i in range(4)]
+        return packCrsfToBytes(sticks + [172, 992, 1811, 172] + [992] * 8)
+
+    def _link_statistics(self, t):
+        r = self.random
+        rssi = -60 - r.randrange(20)
+        return LINK_STATISTICS_STRUCT.pack(rssi, rssi - r.randrange(4), 100 - r.randrange(10),
+                                           r.randrange(-5, 12), r.randrange(2), 6, 3,
+                                           rssi + 2, 100 - r.randrange(10), r.randrange(-5, 12))
+
+    def _attitude(self, t):
+        return ATTITUDE_STRUCT.pack(int(3000 * math.sin(t)), int(5000 * math.sin(t * 0.7)),
+                                    int((t * 1000) % 62832 - 31416))
+
+    def _gps(self, t):
+        return GPS_STRUCT.pack(473977000 + int(t * 90), 85456000 + int(t * 130), 360 + self.random.randrange(40),
+                               int(t * 500) % 36000, 1100 + int(20 * math.sin(t / 10)), 12)
+
+    def _battery_sensor(self, t):
+        used = int(t * 2.5)
+        return BATTERY_SENSOR_STRUCT.pack(168 - used // 300, 120 + self.random.randrange(40),
+                                          used >> 16, used & 0xFFFF, max(0, 100 - used // 30))
+
+    def _flight_mode(self, t):
+        return FLIGHT_MODES[int(t / 20) % len(FLIGHT_MODES)] + b'\x00'
+
+    def _error_gap(self) -> int:
+        # Bits until the next flipped bit (geometric), so clean bits cost nothing
+        if self.ber <= 0:
+            return -1
+        if self.ber >= 1:
+            return 0
+        return int(math.log(1.0 - self.random.random()) / math.log(1.0 - self.ber))
+
+    def _flip_bits(self, frame):
+        bits = len(frame) * 8
+        position = self._next_error
+        if position >= bits:
+            self._next_error -= bits
+            return False
+        while position < bits:
+            frame[position >> 3] ^= 1 << (position & 7)
+            self.bit_errors += 1
+            position += 1 + self._error_gap()
+        self._next_error = position - bits
+        return True
+
+    def schedule(self, duration):
+        # (time_ns, ptype) for every frame in [0, duration) seconds, in time
+        # order; types start at staggered offsets within their first period
+        heap = []
+        for ptype, rate in self.rates.items():
+            if rate > 0:
+                period = 1e9 / rate
+                heap.append((self.random.random() * period, period, ptype))
+        heapq.heapify(heap)
+        end = duration * 1e9
+        while heap and heap[0][0] < end:
+            t, period, ptype = heap[0]
+            heapq.heapreplace(heap, (t + period, period, ptype))
+            yield int(t), ptype
+
+    def frames(self, duration):
+        # Yields (time_ns, bytes) with faults already applied; the bytes may
+        # hold garbage followed by a (possibly damaged or cut) frame
+        r = self.random
+        for t, ptype in self.schedule(duration):
+            payload = self.builders[ptype](t / 1e9)
+            crc = crc8_data(payload, crc=CRC8_TABLE[ptype])
+            frame = bytearray((CRSF_SYNC, len(payload) + 2, ptype))
+            frame += payload
+            frame.append(crc)
+            self.counts[ptype] += 1
+            if self.ber > 0 and self._flip_bits(frame):
+                self.corrupted += 1
+            if self.truncate and r.random() < self.truncate:
+                del frame[r.randrange(1, len(frame)):]
+                self.truncated += 1
+            if self.garbage and r.random() < self.garbage:
+                junk = r.randbytes(r.randrange(1, self.garbage_len + 1))
+                self.garbage_bytes += len(junk)
+                frame[:0] = junk
+            yield t, frame
+
+    def chunks(self, duration, size=65536):
+        # The stream as chunks of about `size` bytes
+        chunk = bytearray()
+        for t, frame in self.frames(duration):
+            chunk += frame
+            if len(chunk) >= size:
+                yield bytes(chunk)
+                chunk.clear()
+        if chunk:
+            yield bytes(chunk)
+
+    def generate(self, duration) -> bytes:
+        return b''.join(self.chunks(duration))
+
+    def write(self, path, duration) -> int:
+        total = 0
+        with open(path, 'wb') as f:
+            for chunk in self.chunks(duration):
+                f.write(chunk)
+                total += len(chunk)
+        return total
+
+    def write_capture(self, path, duration) -> int:
+        # Raw capture with the scheduled timestamps, for crsf_replay.py
+        from crsf_capture import CaptureWriter
+        with CaptureWriter(path) as writer:
+            link = writer.link('synthetic')
+            base = time.monotonic_ns()
+            for t, frame in self.frames(duration):
+                writer.write_raw(frame, link, base + t)
+            return writer.records - 1
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('output', help='File to write')
+    parser.add_argument('-d', '--duration', type=float, default=60.0,
+                    help='Seconds of link time to generate')
+    parser.add_argument('-s', '--seed', type=int, default=0)
+    parser.add_argument('--ber', type=float, default=0.0,
+                    help='Bit error rate, e.g. 1e-5')
+    parser.add_argument('--truncate', type=float, default=0.0,
+                    help='Probability of a frame being cut short')
+    parser.add_argument('--garbage', type=float, default=0.0,
+                    help='Probability of a garbage run before a frame')
+    parser.add_argument('--rc-rate', type=int, default=TYPE_RATES[PacketsTypes.RC_CHANNELS_PACKED],
+                    help='RC_CHANNELS_PACKED frames per second')
+    parser.add_argument('-c', '--capture', action='store_true',
+                    help='Write a capture file (for crsf_replay.py) instead of raw bytes')
+    args = parser.parse_args()
+
+    rates = dict(TYPE_RATES)
+    rates[PacketsTypes.RC_CHANNELS_PACKED] = args.rc_rate
+    generator = StreamGenerator(args.seed, rates, args.ber, args.truncate, args.garbage)
+    start = time.perf_counter()
+    if args.capture:
+        size = generator.write_capture(args.output, args.duration)
+        what = f"{size} records"
+    else:
+        size = generator.write(args.output, args.duration)
+        what = f"{size / 1e6:.2f} MB"
+    elapsed = time.perf_counter() - start
+    frames = sum(generator.counts.values())
+    print(f"{args.output}: {what}, {frames} frames in {elapsed:.2f} s ({frames / elapsed:.0f} frames/s)")
+    for ptype, count in generator.counts.items():
+        print(f"  {PacketsTypes(ptype).name}: {count}")
+    print(f"  bit errors: {generator.bit_errors} in {generator.corrupted} frames, "
+          f"truncated: {generator.truncated}, garbage bytes: {generator.garbage_bytes}")
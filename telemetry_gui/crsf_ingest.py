@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+import argparse
+import queue
+import threading
+import time
+
+import serial
+
+from crsf_capture import CaptureWriter
+from crsf_metrics import MetricsServer, parse_address
+from crsf_parser import CrsfDeframer, PacketsTypes, ParserStats, RECORD_TYPES, decode_payload
+
+__all__ = [
+    'LinkReader',
+    'IngestEngine',
+    'parse_link'
+]
+
+class LinkReader:
+    """Reads and deframes one serial link on its own thread"""
+
+    # Types decoded on the read thread for the metrics endpoint
+    METRIC_TYPES = (PacketsTypes.LINK_STATISTICS, PacketsTypes.BATTERY_SENSOR)
+
+    def __init__(self, link_id, port, baudrate, output, timeout=0.1, on_data=None, stats=None, metrics=None):
+        # output(timestamp_ns, link_id, ptype, frame) runs on this thread;
+        # on_data sees raw bytes before deframing (see CrsfDeframer);
+        # metrics: MetricsServer to publish this link's stats to
+        self.link_id = link_id
+        self.port = port
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.output = output
+        self.deframer = CrsfDeframer(resync=True, on_data=on_data, stats=stats)
+        self.metrics = metrics
+        self.records = {ptype: RECORD_TYPES[ptype]() for ptype in self.METRIC_TYPES}
+        self.running = False
+        self.connected = False
+        self.bytes = 0
+        self.frames = 0
+        self.errors = 0
+        self._thread = None
+
+    def counters(self) -> dict:
+        counters = {
+            'connected': self.connected,
+            'bytes': self.bytes,
+            'frames': self.frames,
+            'bytes_skipped': self.deframer.bytes_skipped,
+            'errors': self.errors,
+        }
+        stats = self.deframer.stats
+        if stats is not None:
+            counters.update(crc_errors=stats.crc_errors, short_frames=stats.short_frames, resyncs=stats.resyncs,
+                            high_water=stats.high_water, latency_p99_us=stats.latency_percentile(99))
+        return counters
+
+    def _read(self, ser):
+        deframer = self.deframer
+        output = self.output
+        link_id = self.link_id
+        metrics = self.metrics
+        records = self.records
+        while self.running:
+            # Blocks in select()/read with the GIL released, so links on
+            # separate threads read in parallel
+            n = deframer.fill(ser, wait=True)
+            if metrics is not None:
+                metrics.publish(link_id, deframer.stats, records)
+            if not n:
+                continue
+            now = time.monotonic_ns()
+            self.bytes += n
+            for frame in deframer.frames():
+                self.frames += 1
+                ptype = frame[2]
+                if metrics is not None and ptype in records:
+                    decode_payload(ptype, frame, records[ptype])
+                output(now, link_id, ptype, frame)
+
+    def run(self):
+        while self.running:
+            try:
+                with serial.Serial(self.port, self.baudrate, timeout=self.timeout) as ser:
+                    self.connected = True
+                    self._read(ser)
+            except serial.SerialException as e:
+                self.errors += 1
+                print(f"{self.link_id}: {e}")
+                if self.metrics is not None:
+                    self.metrics.publish(self.link_id, self.deframer.stats, self.records, connected=False)
+                time.sleep(1.0)
+            finally:
+                self.connected = False
+
+    def start(self):
+        self.running = True
+        self._thread = threading.Thread(target=self.run, name=f"link-{self.link_id}", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+class IngestEngine:
+    """Runs N LinkReaders and merges their frames into one timestamped stream"""
+
+    def __init__(self, links, maxsize=65536, recorder=None, record_raw=False, stats=False, metrics=None):
+        # links: iterable of (link_id, port, baudrate); recorder: optional
+        # CaptureWriter getting each link's frames, or raw bytes if record_raw;
+        # stats gives each link a ParserStats (reader.deframer.stats);
+        # metrics: MetricsServer every link publishes to (implies stats)
+        self.queue = queue.Queue(maxsize)
+        self.dropped = 0
+        self.recorder = recorder
+        self._record_frames = recorder is not None and not record_raw
+        self.readers = []
+        for link_id, port, baudrate in links:
+            on_data = None
+            if recorder is not None and record_raw:
+                on_data = recorder.raw_sink(recorder.link(link_id))
+            self.readers.append(LinkReader(link_id, port, baudrate, self._put, on_data=on_data,
+                                           stats=ParserStats() if stats or metrics else None,
+                                           metrics=metrics))
+        self._last = {}
+
+    def _put(self, timestamp_ns, link_id, ptype, frame):
+        if self._record_frames:
+            self.recorder.write_frame(frame, self.recorder.link(link_id), timestamp_ns)
+        # The frame is copied: the memoryview belongs to the link's deframer
+        try:
+            self.queue.put_nowait((timestamp_ns, link_id, ptype, bytes(frame)))
+        except queue.Full:
+            # A slow consumer must not stall the serial readers
+            self.dropped += 1
+
+    def start(self):
+        for reader in self.readers:
+            reader.start()
+
+    def stop(self):
+        for reader in self.readers:
+            reader.running = False
+        for reader in self.readers:
+            reader.stop()
+        if self.recorder is not None:
+            self.recorder.close()
+
+    def frames(self, timeout=None):
+        # Yields (timestamp_ns, link_id, ptype, frame bytes) in arrival
+        # order; stops when nothing arrives within timeout
+        get = self.queue.get
+        while True:
+            try:
+                yield get(timeout=timeout)
+            except queue.Empty:
+                return
+
+    def counters(self) -> dict:
+        # Per-link totals plus bytes/frames per second since the last call
+        now = time.monotonic()
+        result = {}
+        for reader in self.readers:
+            counters = reader.counters()
+            last_time, last_bytes, last_frames = self._last.get(reader.link_id, (now, 0, 0))
+            elapsed = now - last_time
+            counters['bytes_per_sec'] = (counters['bytes'] - last_bytes) / elapsed if elapsed else 0.0
+            counters['frames_per_sec'] = (counters['frames'] - last_frames) / elapsed if elapsed else 0.0
+            self._last[reader.link_id] = (now, counters['bytes'], counters['frames'])
+            result[reader.link_id] = counters
+        return result
+
+def parse_link(text, baudrate):
+    # "id=port" or "id=port:baud", e.g. rx1=/dev/ttyUSB0:420000; the id
+    # defaults to the port name
+    link_id, sep, port = text.partition('=')
+    if not sep:
+        port = link_id
+    head, sep, tail = port.rpartition(':')
+    if sep and tail.isdigit():
+        port, baudrate = head, int(tail)
+    return link_id, port, baudrate
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-L', '--link', action='append', required=True,
+                    help='Link as id=port[:baud], e.g. rx1=/dev/ttyUSB0:420000 (repeatable)')
+    parser.add_argument('-b', '--baud', type=int, default=921600, required=False,
+                    help='Baud rate for links that do not give one')
+    parser.add_argument('-w', '--record', metavar='FILE',
+                    help='Record every link to one capture file')
+    parser.add_argument('--record-raw', action='store_true',
+                    help='Record raw serial bytes (before deframing) instead of frames')
+    parser.add_argument('-S', '--stats', action='store_true',
+                    help='Also count CRC errors, resyncs and read-to-dispatch latency per link')
+    parser.add_argument('-m', '--metrics', metavar='[HOST:]PORT',
+                    help='Serve Prometheus metrics for every link on this port (implies --stats)')
+    args = parser.parse_args()
+
+    recorder = CaptureWriter(args.record) if args.record else None
+    metrics = None
+    if args.metrics:
+        metrics = MetricsServer(*parse_address(args.metrics))
+        metrics.start()
+        print(f"Metrics on http://{metrics.host}:{metrics.port}/metrics")
+    engine = IngestEngine([parse_link(text, args.baud) for text in args.link],
+                          recorder=recorder, record_raw=args.record_raw, stats=args.stats,
+                          metrics=metrics)
+    engine.start()
+    types = {}
+    next_report = time.monotonic() + 1.0
+    try:
+        while True:
+            try:
+                timestamp_ns, link_id, ptype, frame = engine.queue.get(timeout=0.1)
+                types[link_id, ptype] = types.get((link_id, ptype), 0) + 1
+            except queue.Empty:
+                pass
+            if time.monotonic() >= next_report:
+                next_report += 1.0
+                for link_id, c in engine.counters().items():
+                    print(f"{link_id}: {'up' if c['connected'] else 'down'} "
+                          f"{c['bytes_per_sec']:.0f} B/s {c['frames_per_sec']:.0f} frames/s "
+                          f"skipped={c['bytes_skipped']} errors={c['errors']} dropped={engine.dropped}"
+                          + (f" crc={c['crc_errors']} resyncs={c['resyncs']} p99<{c['latency_p99_us']:.0f}us"
+                             if 'crc_errors' in c else ""))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        try:
+            engine.stop()
+        except OSError as e:
+            print(f"Recording failed: {e}")
+        if metrics is not None:
+            metrics.stop()
+        for (link_id, ptype), count in sorted(types.items()):
+            name = PacketsTypes(ptype).name if ptype in PacketsTypes._value2member_map_ else f"0x{ptype:02x}"
+            print(f"{link_id} {name}: {count}")
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from crsf_parser import PacketsTypes
+
+__all__ = [
+    'MetricsServer',
+    'parse_address'
+]
+
+def _label(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+# (metric, type, help) in the order they are written
+METRICS = (
+    ('crsf_link_up', 'gauge', 'Whether the serial link is open'),
+    ('crsf_bytes_total', 'counter', 'Bytes read from the link'),
+    ('crsf_frames_total', 'counter', 'CRC-valid frames by type'),
+    ('crsf_frames_per_second', 'gauge', 'Frames per second by type over the last publish interval'),
+    ('crsf_crc_errors_total', 'counter', 'Frames that failed the CRC check'),
+    ('crsf_crc_errors_per_second', 'gauge', 'CRC errors per second over the last publish interval'),
+    ('crsf_short_frames_total', 'counter', 'CRC-valid frames too short for their type, dropped'),
+    ('crsf_bytes_discarded_total', 'counter', 'Bytes dropped while looking for a frame'),
+    ('crsf_resyncs_total', 'counter', 'Times the deframer skipped ahead to the next sync byte'),
+    ('crsf_buffer_high_water_bytes', 'gauge', 'Most bytes ever pending in the deframer buffer'),
+    ('crsf_read_to_dispatch_seconds', 'histogram', 'Time from a serial read to its frame being dispatched'),
+    ('crsf_link_rssi_dbm', 'gauge', 'Uplink RSSI per antenna, and downlink RSSI'),
+    ('crsf_link_quality_percent', 'gauge', 'Uplink and downlink link quality'),
+    ('crsf_link_snr_db', 'gauge', 'Uplink and downlink SNR'),
+    ('crsf_link_active_antenna', 'gauge', 'Active uplink antenna'),
+    ('crsf_link_rf_mode', 'gauge', 'RF mode index'),
+    ('crsf_link_tx_power', 'gauge', 'Uplink TX power index'),
+    ('crsf_battery_voltage_volts', 'gauge', 'Battery voltage'),
+    ('crsf_battery_current_amps', 'gauge', 'Battery current'),
+    ('crsf_battery_consumed_mah', 'gauge', 'Capacity used'),
+    ('crsf_battery_remaining_percent', 'gauge', 'Battery remaining'),
+)
+
+class MetricsServer:
+    """Serves link and parser metrics in Prometheus text format from a background thread"""
+
+    def __init__(self, host='127.0.0.1', port=9464, interval=1.0):
+        # interval: seconds between snapshots of one link; publish() calls
+        # in between return at once
+        self.host = host
+        self.port = port
+        self.interval = interval
+        # link_id -> {metric: [sample lines]}, replaced whole on publish, so
+        # a scrape only ever reads an immutable snapshot
+        self._samples = {}
+        # Held by publishers only, around the copy and swap; scrapes never take it
+        self._swap_lock = threading.Lock()
+        self._next = {}
+        self._last = {}
+        self._server = None
+        self._thread = None
+
+    def publish(self, link_id, stats, records=None, connected=True):
+        # Called from the serial read thread with that link's ParserStats and
+        # latest decoded records (ptype -> record, like crsf_parser.latest)
+        now = time.monotonic()
+        if now < self._next.get(link_id, 0.0):
+            return
+        self._next[link_id] = now + self.interval
+        # Snapshot first, outside the lock; the copy and swap is then short
+        # and links publishing from other threads never lose an update
+        samples = self._snapshot(link_id, stats, records or {}, connected, now)
+        with self._swap_lock:
+            self._samples = {**self._samples, link_id: samples}
+
+    def _snapshot(self, link_id, stats, records, connected, now) -> dict:
+        link = f'link="{_label(link_id)}"'
+        samples = {name: [] for name, kind, text in METRICS}
+        samples['crsf_link_up'].append(f'crsf_link_up{{{link}}} {int(connected)}')
+        if stats is None:
+            return samples
+        snapshot = stats.snapshot()
+        last_time, last_crc = self._last.get(link_id, (now, snapshot['crc_errors']))
+        self._last[link_id] = (now, snapshot['crc_errors'])
+        elapsed = now - last_time
+        crc_rate = (snapshot['crc_errors'] - last_crc) / elapsed if elapsed else 0.0
+
+        samples['crsf_bytes_total'].append(f'crsf_bytes_total{{{link}}} {snapshot["bytes"]}')
+        for name, count in snapshot['frames_by_type'].items():
+            samples['crsf_frames_total'].append(f'crsf_frames_total{{{link},type="{name}"}} {count}')
+            samples['crsf_frames_per_second'].append(
+                f'crsf_frames_per_second{{{link},type="{name}"}} {snapshot["frames_per_sec"][name]:.3f}')
+        samples['crsf_crc_errors_total'].append(f'crsf_crc_errors_total{{{link}}} {snapshot["crc_errors"]}')
+        samples['crsf_crc_errors_per_second'].append(f'crsf_crc_errors_per_second{{{link}}} {crc_rate:.3f}')
+        samples['crsf_short_frames_total'].append(f'crsf_short_frames_total{{{link}}} {snapshot["short_frames"]}')
+        samples['crsf_bytes_discarded_total'].append(
+            f'crsf_bytes_discarded_total{{{link}}} {snapshot["bytes_discarded"]}')
+        samples['crsf_resyncs_total'].append(f'crsf_resyncs_total{{{link}}} {snapshot["resyncs"]}')
+        samples['crsf_buffer_high_water_bytes'].append(
+            f'crsf_buffer_high_water_bytes{{{link}}} {snapshot["high_water"]}')
+
+        histogram = samples['crsf_read_to_dispatch_seconds']
+        cumulative = 0
+        for bucket, count in enumerate(snapshot['latency_us'][:-1]):
+            cumulative += count
+            histogram.append(f'crsf_read_to_dispatch_seconds_bucket{{{link},le="{(1 << bucket) / 1e6:g}"}} {cumulative}')
+        cumulative += snapshot['latency_us'][-1]
+        histogram.append(f'crsf_read_to_dispatch_seconds_bucket{{{link},le="+Inf"}} {cumulative}')
+        histogram.append(f'crsf_read_to_dispatch_seconds_sum{{{link}}} {stats.latency_sum_ns / 1e9:.9f}')
+        histogram.append(f'crsf_read_to_dispatch_seconds_count{{{link}}} {cumulative}')
+
+        # Decoded values only once the type has actually been received
+        ls = records.get(PacketsTypes.LINK_STATISTICS)
+        if ls is not None and stats.frames[PacketsTypes.LINK_STATISTICS]:
+            samples['crsf_link_rssi_dbm'] += [
+                f'crsf_link_rssi_dbm{{{link},direction="uplink",antenna="1"}} {ls.rssi1}',
+                f'crsf_link_rssi_dbm{{{link},direction="uplink",antenna="2"}} {ls.rssi2}',
+                f'crsf_link_rssi_dbm{{{link},direction="downlink",antenna="1"}} {ls.downlink_rssi}',
+            ]
+            samples['crsf_link_quality_percent'] += [
+                f'crsf_link_quality_percent{{{link},direction="uplink"}} {ls.lq}',
+                f'crsf_link_quality_percent{{{link},direction="downlink"}} {ls.downlink_lq}',
+            ]
+            samples['crsf_link_snr_db'] += [
+                f'crsf_link_snr_db{{{link},direction="uplink"}} {ls.snr}',
+                f'crsf_link_snr_db{{{link},direction="downlink"}} {ls.downlink_snr}',
+            ]
+            samples['crsf_link_active_antenna'].append(f'crsf_link_active_antenna{{{link}}} {ls.antenna}')
+            samples['crsf_link_rf_mode'].append(f'crsf_link_rf_mode{{{link}}} {ls.mode}')
+            samples['crsf_link_tx_power'].append(f'crsf_link_tx_power{{{link}}} {ls.power}')
+        bat = records.get(PacketsTypes.BATTERY_SENSOR)
+        if bat is not None and stats.frames[PacketsTypes.BATTERY_SENSOR]:
+            samples['crsf_battery_voltage_volts'].append(f'crsf_battery_voltage_volts{{{link}}} {bat.voltage:g}')
+            samples['crsf_battery_current_amps'].append(f'crsf_battery_current_amps{{{link}}} {bat.current:g}')
+            samples['crsf_battery_consumed_mah'].append(f'crsf_battery_consumed_mah{{{link}}} {bat.mah}')
+            samples['crsf_battery_remaining_percent'].append(
+                f'crsf_battery_remaining_percent{{{link}}} {bat.percent}')
+        return samples
+
+    def render(self) -> bytes:
+        # Prometheus text exposition format, version 0.0.4
+        links = self._samples
+        lines = []
+        for name, kind, text in METRICS:
+            block = [line for samples in links.values() for line in samples[name]]
+            if block:
+                lines.append(f'# HELP {name} {text}')
+                lines.append(f'# TYPE {name} {kind}')
+                lines += block
+        lines.append('')
+        return '\n'.join(lines).encode('utf-8')
+
+    def start(self):
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?', 1)[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = metrics.render()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        # Port 0 picks a free port; report the real one
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, name='MetricsServer', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._thread.join()
+            self._server = self._thread = None
+
+def parse_address(text, host='127.0.0.1'):
+    # "9464" or "0.0.0.0:9464"
+    head, sep, tail = text.rpartition(':')
+    return (head or host) if sep else host, int(tail)
@@ -2,19 +2,63 @@
 import serial
 import time
 import argparse
+import functools
+import logging
+import queue
+import struct
+import sys
+import threading
 from enum import IntEnum
 
+try:
+    import numpy as np
+except ImportError:
+    # Only needed for the batch channel decoder
+    np = None
+
 __all__ = [
+    'CRC8_TABLE',
+    'Crc8',
     'crc8_dvb_s2',
     'crc8_data',
     'crsf_validate_frame',
+    'crsf_frame',
+    'ParserStats',
+    'CrsfDeframer',
     'signed_byte',
     'packCrsfToBytes',
     'channelsCrsfToChannelsPacket',
+    'cachedChannelsPacket',
+    'channelsCrsfToChannelsPackets',
+    'unpackCrsfFromBytes',
+    'channelsPacketsToCrsfArray',
+    'TelemetryRecord',
+    'LinkStatistics',
+    'Attitude',
+    'BatterySensor',
+    'Gps',
+    'Vario',
+    'FlightMode',
+    'RcChannels',
+    'PAYLOAD_DECODERS',
+    'RECORD_TYPES',
+    'MIN_FRAME_LENGTHS',
+    'decode_payload',
+    'TxScheduler',
+    'HexDump',
+    'PacketLog',
+    'packet_log',
+    'LatestFrames',
+    'CrsfDispatcher',
+    'register_handler',
+    'unregister_handler',
     'handleCrsfPacket'
 ]
 
 CRSF_SYNC = 0xC8
+# Device addresses a frame can start with: flight controller (also the
+# sync byte), radio transmitter, receiver, CRSF transmitter module
+CRSF_ADDRESSES = (CRSF_SYNC, 0xEA, 0xEC, 0xEE)
 
 class PacketsTypes(IntEnum):
     GPS = 0x02
@@ -32,23 +76,281 @@ class PacketsTypes(IntEnum):
     CONFIG_WRITE = 0x2D
     RADIO_ID = 0x3A
 
+def _crc8_table(poly) -> bytes:
+    table = bytearray(256)
+    for i in range(256):
+        crc = i
+        for ii in range(8):
+            if crc & 0x80:
+                crc = (crc << 1) ^ poly
+            else:
+                crc = crc << 1
+        table[i] = crc & 0xFF
+    return bytes(table)
+
+# CRC8 DVB-S2 (poly 0xD5), one lookup per byte instead of an 8-step bit loop
+CRC8_TABLE = _crc8_table(0xD5)
+
 def crc8_dvb_s2(crc, a) -> int:
-  crc = crc ^ a
-  for ii in range(8):
-    if crc & 0x80:
-      crc = (crc << 1) ^ 0xD5
-    else:
-      crc = crc << 1
-  return crc & 0xFF
+    return CRC8_TABLE[(crc ^ a) & 0xFF]
 
-def crc8_data(data) -> int:
-    crc = 0
+def crc8_data(data, start=0, end=None, crc=0) -> int:
+    # Works on bytes/bytearray/memoryview; start/end select a range without
+    # copying it out, crc lets a previous result be continued
+    table = CRC8_TABLE
+    if start or end is not None:
+        with memoryview(data) as view, view[start:end] as part:
+            for a in part:
+                crc = table[crc ^ a]
+        return crc
     for a in data:
-        crc = crc8_dvb_s2(crc, a)
+        crc = table[crc ^ a]
     return crc
 
+class Crc8:
+    """Incremental CRC8 DVB-S2 for frames that arrive in pieces"""
+    __slots__ = ('value',)
+
+    def __init__(self, value=0):
+        self.value = value
+
+    def reset(self):
+        self.value = 0
+
+    def update_byte(self, a):
+        self.value = CRC8_TABLE[self.value ^ a]
+        return self.value
+
+    def update(self, data, start=0, end=None):
+        self.value = crc8_data(data, start, end, self.value)
+        return self.value
+
 def crsf_validate_frame(frame) -> bool:
-    return crc8_data(frame[2:-1]) == frame[-1]
+    # CRC covers type + payload: everything after sync/len, before the CRC byte
+    return crc8_data(frame, 2, len(frame) - 1) == frame[-1]
+
+def crsf_frame(ptype, payload, address=CRSF_SYNC) -> bytes:
+    # [address, length, type, payload..., crc]; length counts type + payload + crc
+    crc = crc8_data(payload, crc=CRC8_TABLE[ptype])
+    return bytes((address, len(payload) + 2, ptype)) + bytes(payload) + bytes((crc,))
+
+class ParserStats:
+    """Hot-path counters and a read-to-dispatch latency histogram, filled in by CrsfDeframer"""
+    # Bucket n counts latencies below 2**n microseconds; the last is open-ended
+    LATENCY_BUCKETS = 24
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.frames = [0] * 256
+        self.bytes = 0
+        self.crc_errors = 0
+        self.short_frames = 0
+        self.bytes_discarded = 0
+        self.resyncs = 0
+        self.high_water = 0
+        self.latency = [0] * self.LATENCY_BUCKETS
+        self.latency_sum_ns = 0
+        self.read_ns = 0
+        self._last_time = time.monotonic()
+        self._last_frames = [0] * 256
+
+    def record_latency(self, ns):
+        self.latency_sum_ns += ns
+        bucket = (ns // 1000).bit_length()
+        self.latency[bucket if bucket < self.LATENCY_BUCKETS else self.LATENCY_BUCKETS - 1] += 1
+
+    def latency_percentile(self, p) -> float:
+        # Upper bound in microseconds of the bucket holding the p-th percentile
+        total = sum(self.latency)
+        if not total:
+            return 0.0
+        rank = total * p / 100.0
+        seen = 0
+        for bucket, count in enumerate(self.latency):
+            seen += count
+            if seen >= rank:
+                return float(1 << bucket)
+        return float(1 << (self.LATENCY_BUCKETS - 1))
+
+    def snapshot(self) -> dict:
+        # Totals, plus per-type frames/s since the previous snapshot() call
+        now = time.monotonic()
+        frames = list(self.frames)
+        elapsed = now - self._last_time
+        by_type = {}
+        rates = {}
+        for ptype, count in enumerate(frames):
+            if count:
+                name = PacketsTypes(ptype).name if ptype in PacketsTypes._value2member_map_ else f"0x{ptype:02x}"
+                by_type[name] = count
+                rates[name] = (count - self._last_frames[ptype]) / elapsed if elapsed else 0.0
+        self._last_time = now
+        self._last_frames = frames
+        return {
+            'frames': sum(frames),
+            'frames_by_type': by_type,
+            'frames_per_sec': rates,
+            'bytes': self.bytes,
+            'crc_errors': self.crc_errors,
+            'short_frames': self.short_frames,
+            'bytes_discarded': self.bytes_discarded,
+            'resyncs': self.resyncs,
+            'high_water': self.high_water,
+            'latency_us': list(self.latency),
+            'latency_p50_us': self.latency_percentile(50),
+            'latency_p99_us': self.latency_percentile(99),
+        }
+
+class CrsfDeframer:
+    """Splits a serial byte stream into CRSF frames without reslicing the buffer"""
+
+    def __init__(self, size=4096, on_crc_error=None, resync=False, on_data=None, stats=None):
+        # Preallocated buffer; pending bytes live in buffer[start:end]
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        self.start = 0
+        self.end = 0
+        self.on_crc_error = on_crc_error
+        # on_data(view) sees every chunk as it arrives, before deframing
+        # (raw capture); the view is only valid during the call
+        self.on_data = on_data
+        # resync: on a bad length or CRC skip to the next device address
+        # instead of dropping the buffer, so frames behind a glitch survive
+        self.resync = resync
+        self.bytes_skipped = 0
+        # Optional ParserStats; with None the hot path only pays an `is None` test
+        self.stats = stats
+
+    def __len__(self):
+        return self.end - self.start
+
+    def _compact(self):
+        # Move the (short) unfinished tail to the front to make room
+        pending = self.end - self.start
+        if self.start:
+            self.view[:pending] = self.view[self.start:self.end]
+            self.start = 0
+            self.end = pending
+        return len(self.buffer) - pending
+
+    def get_buffer(self, size=64):
+        # Free space for readers that write into the buffer themselves
+        # (os.readv, asyncio.BufferedProtocol); report with buffer_updated
+        if len(self.buffer) - self.end < size:
+            self._compact()
+        return self.view[self.end:]
+
+    def buffer_updated(self, nbytes):
+        if self.on_data is not None and nbytes:
+            self.on_data(self.view[self.end:self.end + nbytes])
+        self.end += nbytes
+        stats = self.stats
+        if stats is not None and nbytes:
+            stats.bytes += nbytes
+            stats.read_ns = time.perf_counter_ns()
+            if self.end - self.start > stats.high_water:
+                stats.high_water = self.end - self.start
+
+    def readinto(self, stream, size) -> int:
+        free = len(self.buffer) - self.end
+        if free < size:
+            free = self._compact()
+        n = stream.readinto(self.view[self.end:self.end + min(size, free)]) or 0
+        self.buffer_updated(n)
+        return n
+
+    def fill(self, ser, wait=False) -> int:
+        # wait: block up to ser.timeout for the first byte (pyserial waits in
+        # select/overlapped I/O, not a poll loop), then also take whatever
+        # else is buffered. Otherwise read only what the port already holds.
+        waiting = ser.in_waiting
+        if wait and not waiting:
+            if not self.readinto(ser, 1):
+                return 0
+            waiting = ser.in_waiting
+            return 1 + (self.readinto(ser, waiting) if waiting else 0)
+        return self.readinto(ser, waiting) if waiting else 0
+
+    def feed(self, data) -> int:
+        # For byte sources that are not file-like (captures, tests)
+        size = len(data)
+        free = len(self.buffer) - self.end
+        if free < size:
+            free = self._compact()
+        size = min(size, free)
+        self.view[self.end:self.end + size] = data[:size]
+        self.buffer_updated(size)
+        return size
+
+    def _next_sync(self, start) -> int:
+        # Earliest known device address at or after start, else end
+        best = self.end
+        for address in CRSF_ADDRESSES:
+            pos = self.buffer.find(address, start, best)
+            if pos != -1:
+                best = pos
+        return best
+
+    def _skip_to(self, pos):
+        self.bytes_skipped += pos - self.start
+        if self.stats is not None:
+            self.stats.bytes_discarded += pos - self.start
+            if self.resync:
+                self.stats.resyncs += 1
+        self.start = pos
+
+    def frames(self):
+        # Yields CRC-valid frames as memoryviews into the buffer; a frame is
+        # only valid until the next readinto/fill/feed call
+        buf = self.buffer
+        stats = self.stats
+        while self.end - self.start > 2:
+            start = self.start
+            if self.resync and buf[start] not in CRSF_ADDRESSES:
+                self._skip_to(self._next_sync(start + 1))
+                continue
+            # Without resync this simple parser works with malformed CRSF
+            # streams: it does not check the first byte for SYNC_BYTE, but
+            # instead just looks for anything where the packet length
+            # is 4-64 bytes, and the CRC validates
+            expected_len = buf[start + 1] + 2
+            if expected_len > 64 or expected_len < 4:
+                if self.resync:
+                    self._skip_to(self._next_sync(start + 1))
+                else:
+                    self._skip_to(self.end)
+            elif self.end - start >= expected_len:
+                frame = self.view[start:start + expected_len]
+                if crsf_validate_frame(frame):
+                    if expected_len >= MIN_FRAME_LENGTHS[frame[2]]:
+                        self.start = start + expected_len
+                        if stats is not None:
+                            stats.frames[frame[2]] += 1
+                            stats.record_latency(time.perf_counter_ns() - stats.read_ns)
+                        yield frame
+                        continue
+                    # CRC-8 passes about 1 in 256 corrupted candidates; one
+                    # too short for its type would make the decoders raise
+                    if stats is not None:
+                        stats.short_frames += 1
+                else:
+                    if stats is not None:
+                        stats.crc_errors += 1
+                    if self.on_crc_error is not None:
+                        self.on_crc_error(frame)
+                if self.resync:
+                    # Could be a false sync: a real frame may start inside it
+                    self._skip_to(self._next_sync(start + 1))
+                else:
+                    if stats is not None:
+                        stats.bytes_discarded += expected_len
+                    self.start = start + expected_len
+            else:
+                break
+        if self.start == self.end:
+            self.start = self.end = 0
 
 def signed_byte(b):
     return b - 256 if b >= 128 else b
@@ -56,128 +358,673 @@ def signed_byte(b):
 def packCrsfToBytes(channels) -> bytes:
     # channels is in CRSF format! (0-1984)
     # Values are packed little-endianish such that bits BA987654321 -> 87654321, 00000BA9
-    # 11 bits per channel x 16 channels = 22 bytes
+    # 11 bits per channel x 16 channels = 22 bytes, built as one 176-bit integer
     if len(channels) != 16:
         raise ValueError('CRSF must have 16 channels')
-    result = bytearray()
-    destShift = 0
-    newVal = 0
-    for ch in channels:
-        # Put the low bits in any remaining dest capacity
-        newVal |= (ch << destShift) & 0xff
-        result.append(newVal)
-
-        # Shift the high bits down and place them into the next dest byte
-        srcBitsLeft = 11 - 8 + destShift
-        newVal = ch >> (11 - srcBitsLeft)
-        # When there's at least a full byte remaining, consume that as well
-        if srcBitsLeft >= 8:
-            result.append(newVal & 0xff)
-            newVal >>= 8
-            srcBitsLeft -= 8
-
-        # Next dest should be shifted up by the bits consumed
-        destShift = srcBitsLeft
-
-    return result
+    value = 0
+    for ch in reversed(channels):
+        value = (value << 11) | (ch & 0x7FF)
+    return value.to_bytes(22, byteorder='little')
+
+# sync, length, type; 24 is packet length
+CHANNELS_PACKET_HEADER = bytes([CRSF_SYNC, 24, PacketsTypes.RC_CHANNELS_PACKED])
 
 def channelsCrsfToChannelsPacket(channels) -> bytes:
-    result = bytearray([CRSF_SYNC, 24, PacketsTypes.RC_CHANNELS_PACKED]) # 24 is packet length
-    result += packCrsfToBytes(channels)
-    result.append(crc8_data(result[2:]))
-    print(f"result {result}")
-    return result
+    payload = packCrsfToBytes(channels)
+    crc = crc8_data(payload, crc=CRC8_TABLE[PacketsTypes.RC_CHANNELS_PACKED])
+    return CHANNELS_PACKET_HEADER + payload + bytes((crc,))
 
-def handleCrsfPacket(ptype, data):
-    print(f"Packet Type: 0x{ptype:02x}")
-    if ptype == PacketsTypes.RADIO_ID and data[5] == 0x10:
-        # print(f"OTX sync:")
-        pass
-    elif ptype == PacketsTypes.LINK_STATISTICS:
-        rssi1 = signed_byte(data[3])
-        rssi2 = signed_byte(data[4])
-        lq = data[5]
-        snr = signed_byte(data[6])
-        antenna = data[7]
-        mode = data[8]
-        power = data[9]
-        # telemetry strength
-        downlink_rssi = signed_byte(data[10])
-        downlink_lq = data[11]
-        downlink_snr = signed_byte(data[12])
-        # print(f"RSSI={rssi1}/{rssi2}dBm LQ={lq:03} mode={mode}") # ant={antenna} snr={snr} power={power} drssi={downlink_rssi} dlq={downlink_lq} dsnr={downlink_snr}")
-    elif ptype == PacketsTypes.ATTITUDE:
-        pitch = int.from_bytes(data[3:5], byteorder='big', signed=True) / 10000.0
-        roll = int.from_bytes(data[5:7], byteorder='big', signed=True) / 10000.0
-        yaw = int.from_bytes(data[7:9], byteorder='big', signed=True) / 10000.0
-        # print(f"Attitude: Pitch={pitch:0.2f} Roll={roll:0.2f} Yaw={yaw:0.2f} (rad)")
-    elif ptype == PacketsTypes.FLIGHT_MODE:
-        packet = ''.join(map(chr, data[3:-2])).split('\x00')[0].strip()
-        # print(f"Flight Mode: {packet}")
-    elif ptype == PacketsTypes.BATTERY_SENSOR:
-        vbat = int.from_bytes(data[3:5], byteorder='big', signed=True) / 10.0
-        curr = int.from_bytes(data[5:7], byteorder='big', signed=True) / 10.0
-        mah = data[7] << 16 | data[8] << 7 | data[9]
-        pct = data[10]
-        # print(f"Battery: {vbat:0.2f}V {curr:0.1f}A {mah}mAh {pct}%")
-    elif ptype == PacketsTypes.BARO_ALT:
-        # print(f"BaroAlt: ")
-        pass
-    elif ptype == PacketsTypes.DEVICE_INFO:
-        packet = ' '.join(map(hex, data))
-        print(f"Device Info: {packet}")
-    elif data[2] == PacketsTypes.GPS:
-        lat = int.from_bytes(data[3:7], byteorder='big', signed=True) / 1e7
-        lon = int.from_bytes(data[7:11], byteorder='big', signed=True) / 1e7
-        gspd = int.from_bytes(data[11:13], byteorder='big', signed=True) / 36.0
-        hdg =  int.from_bytes(data[13:15], byteorder='big', signed=True) / 100.0
-        alt = int.from_bytes(data[15:17], byteorder='big', signed=True) - 1000
-        sats = data[17]
-        # print(f"GPS: Pos={lat} {lon} GSpd={gspd:0.1f}m/s Hdg={hdg:0.1f} Alt={alt}m Sats={sats}")
-    elif ptype == PacketsTypes.VARIO:
-        vspd = int.from_bytes(data[3:5], byteorder='big', signed=True) / 10.0
-        # print(f"VSpd: {vspd:0.1f}m/s")
-    elif ptype == PacketsTypes.RC_CHANNELS_PACKED:
-        print(f"Channels: (data)")
-        pass
+@functools.lru_cache(maxsize=1024)
+def _cachedChannelsPacket(channels) -> bytes:
+    return channelsCrsfToChannelsPacket(channels)
+
+def cachedChannelsPacket(channels) -> bytes:
+    # Same frame for the same stick positions; keyed by the channel tuple
+    return _cachedChannelsPacket(tuple(channels))
+
+def channelsCrsfToChannelsPackets(sequence) -> list:
+    # Pre-encodes a sequence of 16-channel lists, reusing repeated positions
+    return [_cachedChannelsPacket(tuple(channels)) for channels in sequence]
+
+def unpackCrsfFromBytes(data, offset=0) -> list:
+    # Inverse of packCrsfToBytes: the 22 payload bytes read as one
+    # little-endian 176-bit integer hold channel n at bits 11n..11n+10
+    with memoryview(data) as view, view[offset:offset + 22] as payload:
+        value = int.from_bytes(payload, byteorder='little')
+    return [(value >> shift) & 0x7FF for shift in range(0, 176, 11)]
+
+# Byte index and bit shift of each channel within the 22-byte payload
+_CHANNEL_BYTES = [(11 * ch) >> 3 for ch in range(16)]
+_CHANNEL_SHIFTS = [(11 * ch) & 7 for ch in range(16)]
+
+def channelsPacketsToCrsfArray(frames):
+    # Decodes N RC_CHANNELS_PACKED frames (an iterable of 26-byte frames, or
+    # an (N, 26) uint8 array) into an (N, 16) uint16 array of CRSF values
+    if np is None:
+        raise RuntimeError('channelsPacketsToCrsfArray needs numpy (pip install numpy)')
+    if isinstance(frames, np.ndarray):
+        raw = frames
     else:
-        packet = ' '.join(map(hex, data))
-        print(f"Unknown 0x{ptype:02x}: {packet}")
+        raw = np.frombuffer(b''.join(frames), dtype=np.uint8)
+        if raw.size % 26:
+            raise ValueError('RC_CHANNELS_PACKED frames must be 26 bytes')
+        raw = raw.reshape(-1, 26)
+    if raw.ndim != 2 or raw.shape[1] != 26:
+        raise ValueError('RC_CHANNELS_PACKED frames must be 26 bytes')
+    if np.any(raw[:, 2] != PacketsTypes.RC_CHANNELS_PACKED):
+        raise ValueError('not an RC_CHANNELS_PACKED frame')
+
+    # Each channel spans at most 3 bytes; pad so byte+2 is always in range
+    payload = np.zeros((raw.shape[0], 24), dtype=np.uint32)
+    payload[:, :22] = raw[:, 3:25]
+    idx = np.array(_CHANNEL_BYTES)
+    words = payload[:, idx] | (payload[:, idx + 1] << 8) | (payload[:, idx + 2] << 16)
+    return ((words >> np.array(_CHANNEL_SHIFTS, dtype=np.uint32)) & 0x7FF).astype(np.uint16)
+
+# Payload layouts, big-endian, unpacked in place at frame offset 3
+LINK_STATISTICS_STRUCT = struct.Struct('>bbBbBBBbBb')
+ATTITUDE_STRUCT = struct.Struct('>hhh')
+BATTERY_SENSOR_STRUCT = struct.Struct('>hhBHB')
+GPS_STRUCT = struct.Struct('>iiHHHB')
+VARIO_STRUCT = struct.Struct('>h')
+
+class TelemetryRecord:
+    """Base for the slotted per-type records filled in by the decoders"""
+    __slots__ = ()
+
+    def as_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __repr__(self):
+        fields = ' '.join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"{type(self).__name__}({fields})"
+
+class LinkStatistics(TelemetryRecord):
+    __slots__ = ('rssi1', 'rssi2', 'lq', 'snr', 'antenna', 'mode', 'power',
+                 'downlink_rssi', 'downlink_lq', 'downlink_snr')
+
+    def __init__(self):
+        self.rssi1 = self.rssi2 = self.lq = self.snr = 0
+        self.antenna = self.mode = self.power = 0
+        self.downlink_rssi = self.downlink_lq = self.downlink_snr = 0
+
+class Attitude(TelemetryRecord):
+    __slots__ = ('pitch', 'roll', 'yaw')
+
+    def __init__(self):
+        # rad
+        self.pitch = self.roll = self.yaw = 0.0
+
+class BatterySensor(TelemetryRecord):
+    __slots__ = ('voltage', 'current', 'mah', 'percent')
+
+    def __init__(self):
+        self.voltage = self.current = 0.0
+        self.mah = self.percent = 0
+
+class Gps(TelemetryRecord):
+    __slots__ = ('lat', 'lon', 'speed', 'heading', 'altitude', 'sats')
+
+    def __init__(self):
+        # deg, deg, m/s, deg, m
+        self.lat = self.lon = self.speed = self.heading = 0.0
+        self.altitude = self.sats = 0
+
+class Vario(TelemetryRecord):
+    __slots__ = ('vspeed',)
+
+    def __init__(self):
+        # m/s
+        self.vspeed = 0.0
+
+class FlightMode(TelemetryRecord):
+    __slots__ = ('mode',)
+
+    def __init__(self):
+        self.mode = 'UNKNOWN'
+
+class RcChannels(TelemetryRecord):
+    __slots__ = ('channels',)
+
+    def __init__(self):
+        # CRSF values (0-1984)
+        self.channels = [0] * 16
+
+# Decoders fill in `out` when given one, so callers that keep a record per
+# type decode without allocating; otherwise a new record is returned
+
+def decode_link_statistics(data, out=None) -> LinkStatistics:
+    if out is None:
+        out = LinkStatistics()
+    (out.rssi1, out.rssi2, out.lq, out.snr, out.antenna, out.mode, out.power,
+     out.downlink_rssi, out.downlink_lq, out.downlink_snr) = LINK_STATISTICS_STRUCT.unpack_from(data, 3)
+    return out
+
+def decode_attitude(data, out=None) -> Attitude:
+    if out is None:
+        out = Attitude()
+    pitch, roll, yaw = ATTITUDE_STRUCT.unpack_from(data, 3)
+    out.pitch = pitch / 10000.0
+    out.roll = roll / 10000.0
+    out.yaw = yaw / 10000.0
+    return out
+
+def decode_battery_sensor(data, out=None) -> BatterySensor:
+    if out is None:
+        out = BatterySensor()
+    vbat, curr, mah_hi, mah_lo, pct = BATTERY_SENSOR_STRUCT.unpack_from(data, 3)
+    out.voltage = vbat / 10.0
+    out.current = curr / 10.0
+    out.mah = mah_hi << 16 | mah_lo  # 24 bit
+    out.percent = pct
+    return out
+
+def decode_gps(data, out=None) -> Gps:
+    if out is None:
+        out = Gps()
+    lat, lon, gspd, hdg, alt, sats = GPS_STRUCT.unpack_from(data, 3)
+    out.lat = lat / 1e7
+    out.lon = lon / 1e7
+    out.speed = gspd / 36.0
+    out.heading = hdg / 100.0
+    out.altitude = alt - 1000
+    out.sats = sats
+    return out
+
+def decode_vario(data, out=None) -> Vario:
+    if out is None:
+        out = Vario()
+    out.vspeed = VARIO_STRUCT.unpack_from(data, 3)[0] / 10.0
+    return out
+
+def decode_flight_mode(data, out=None) -> FlightMode:
+    if out is None:
+        out = FlightMode()
+    # Null-terminated string between the type and CRC bytes
+    with memoryview(data) as view:
+        text = bytes(view[3:-1])
+    out.mode = text.split(b'\x00', 1)[0].decode('latin-1').strip()
+    return out
+
+def decode_rc_channels(data, out=None) -> RcChannels:
+    if out is None:
+        out = RcChannels()
+    out.channels = unpackCrsfFromBytes(data, 3)
+    return out
+
+PAYLOAD_DECODERS = {
+    PacketsTypes.LINK_STATISTICS: decode_link_statistics,
+    PacketsTypes.ATTITUDE: decode_attitude,
+    PacketsTypes.BATTERY_SENSOR: decode_battery_sensor,
+    PacketsTypes.GPS: decode_gps,
+    PacketsTypes.VARIO: decode_vario,
+    PacketsTypes.FLIGHT_MODE: decode_flight_mode,
+    PacketsTypes.RC_CHANNELS_PACKED: decode_rc_channels,
+}
+
+RECORD_TYPES = {
+    PacketsTypes.LINK_STATISTICS: LinkStatistics,
+    PacketsTypes.ATTITUDE: Attitude,
+    PacketsTypes.BATTERY_SENSOR: BatterySensor,
+    PacketsTypes.GPS: Gps,
+    PacketsTypes.VARIO: Vario,
+    PacketsTypes.FLIGHT_MODE: FlightMode,
+    PacketsTypes.RC_CHANNELS_PACKED: RcChannels,
+}
+
+# Shortest frame of each type the decoders and handlers can read: address,
+# length and type bytes, the fixed payload, then the CRC. CrsfDeframer drops
+# shorter frames even when their CRC passes.
+MIN_FRAME_LENGTHS = [4] * 256
+for _ptype, _size in (
+        (PacketsTypes.LINK_STATISTICS, LINK_STATISTICS_STRUCT.size),
+        (PacketsTypes.ATTITUDE, ATTITUDE_STRUCT.size),
+        (PacketsTypes.BATTERY_SENSOR, BATTERY_SENSOR_STRUCT.size),
+        (PacketsTypes.GPS, GPS_STRUCT.size),
+        (PacketsTypes.VARIO, VARIO_STRUCT.size),
+        (PacketsTypes.RC_CHANNELS_PACKED, 22),
+        # Extended header (destination, origin), then the subtype byte
+        (PacketsTypes.RADIO_ID, 3)):
+    MIN_FRAME_LENGTHS[_ptype] = 4 + _size
+
+def decode_payload(ptype, data, out=None):
+    # None for types without a decoder, and for frames too short for their
+    # type (ones that did not come through a CrsfDeframer, e.g. old captures)
+    decoder = PAYLOAD_DECODERS.get(ptype)
+    if decoder is None or len(data) < MIN_FRAME_LENGTHS[ptype]:
+        return None
+    return decoder(data, out)
+
+class TxScheduler:
+    """Sends RC_CHANNELS_PACKED at a fixed rate against absolute monotonic deadlines"""
+    RATES = (50, 150, 250, 500)
+
+    def __init__(self, ser, rate=50, channels=None, spin=0.0002):
+        # spin: the last part of each wait is busy-polled, as sleep() alone
+        # can wake up late by a scheduler tick
+        self.ser = ser
+        self.period_ns = 1_000_000_000 // rate
+        self.spin_ns = int(spin * 1e9)
+        self.set_channels(channels if channels is not None else [992] * 16)
+        self.running = False
+        self._thread = None
+        self.reset_stats()
+
+    def set_channels(self, channels):
+        # Frames come from the cache, so unchanged sticks cost a dict lookup
+        self.frame = cachedChannelsPacket(channels)
+
+    def reset_stats(self):
+        self.sent = 0
+        self.missed = 0
+        self._last_ns = 0
+        self._periods = 0
+        self._period_sum = 0
+        self._jitter_sq_sum = 0
+        self._jitter_max = 0
+
+    def stats(self) -> dict:
+        # Actual send period and its deviation from the target, in microseconds
+        n = self._periods
+        mean = self._period_sum / n if n else 0.0
+        return {
+            'rate_hz': 1e9 / self.period_ns,
+            'sent': self.sent,
+            'missed': self.missed,
+            'period_us': mean / 1000.0,
+            'jitter_rms_us': (self._jitter_sq_sum / n) ** 0.5 / 1000.0 if n else 0.0,
+            'jitter_max_us': self._jitter_max / 1000.0,
+        }
+
+    def _wait_until(self, deadline):
+        remaining = deadline - time.monotonic_ns()
+        if remaining > self.spin_ns:
+            time.sleep((remaining - self.spin_ns) / 1e9)
+        while time.monotonic_ns() < deadline:
+            pass
+
+    def _send(self):
+        now = time.monotonic_ns()
+        self.ser.write(self.frame)
+        if self._last_ns:
+            period = now - self._last_ns
+            jitter = abs(period - self.period_ns)
+            self._periods += 1
+            self._period_sum += period
+            self._jitter_sq_sum += jitter * jitter
+            if jitter > self._jitter_max:
+                self._jitter_max = jitter
+        self._last_ns = now
+        self.sent += 1
+
+    def run(self):
+        period = self.period_ns
+        deadline = time.monotonic_ns()
+        while self.running:
+            self._send()
+            # Next slot is fixed relative to the first one, so late wakeups
+            # do not accumulate; slots already behind us are skipped
+            deadline += period
+            late = time.monotonic_ns() - deadline
+            if late >= period:
+                skipped = late // period
+                self.missed += skipped
+                deadline += skipped * period
+            self._wait_until(deadline)
+
+    def start(self):
+        self.running = True
+        self._thread = threading.Thread(target=self.run, name='TxScheduler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+class HexDump:
+    """Defers the ' '.join(map(hex, ...)) of a frame to the log writer"""
+    __slots__ = ('data',)
+
+    def __init__(self, data):
+        # Copy: frames are memoryviews that the deframer will overwrite
+        self.data = bytes(data)
+
+    def __str__(self):
+        return ' '.join(map(hex, self.data))
+
+class PacketLog:
+    """Per-type leveled, rate-limited log lines written by a background thread"""
+    # Seconds between "lines suppressed" summaries from the writer thread
+    SUMMARY_INTERVAL = 1.0
+
+    def __init__(self, level=logging.INFO, rate=10, stream=None, maxsize=4096):
+        # level: lowest logging level shown; rate: lines/sec per frame
+        # type before further lines are counted instead of written (0: no limit)
+        self.levels = [level] * 256
+        self.rates = [rate] * 256
+        self.stream = stream
+        self.dropped = 0
+        # Failed writes (e.g. a closed pipe); the writer keeps draining
+        self.write_errors = 0
+        self._window = [0.0] * 256
+        self._count = [0] * 256
+        # _suppressed is only written by the logging thread and _reported
+        # only by the writer, so neither needs a lock
+        self._suppressed = [0] * 256
+        self._reported = [0] * 256
+        self._queue = queue.Queue(maxsize)
+        self._thread = None
+
+    def set_level(self, ptype, level):
+        self.levels[ptype] = level
+
+    def set_rate(self, ptype, rate):
+        self.rates[ptype] = rate
+
+    def log(self, ptype, level, msg, *args):
+        # msg % args is formatted on the writer thread, so pass plain values
+        # (or HexDump) rather than records that are updated in place
+        if level < self.levels[ptype]:
+            return
+        rate = self.rates[ptype]
+        if rate:
+            now = time.monotonic()
+            if now - self._window[ptype] >= 1.0:
+                self._window[ptype] = now
+                self._count[ptype] = 0
+            elif self._count[ptype] >= rate:
+                self._suppressed[ptype] += 1
+                return
+            self._count[ptype] += 1
+        self._put(msg, args)
+
+    def _put(self, msg, args):
+        if self._thread is None:
+            self.start()
+        try:
+            self._queue.put_nowait((msg, args))
+        except queue.Full:
+            # Never stall decoding on a slow terminal
+            self.dropped += 1
+
+    def _write_suppressed(self, stream):
+        # Writer thread: summarizes lines suppressed since the last summary,
+        # so a type that stops logging still gets its count written
+        for ptype in range(256):
+            count = self._suppressed[ptype] - self._reported[ptype]
+            if count:
+                self._reported[ptype] += count
+                stream.write("0x%02x: %d lines suppressed\n" % (ptype, count))
+
+    def _run(self):
+        next_summary = time.monotonic() + self.SUMMARY_INTERVAL
+        while True:
+            try:
+                item = self._queue.get(timeout=self.SUMMARY_INTERVAL)
+            except queue.Empty:
+                item = ()
+            if item is None:
+                break
+            stream = self.stream or sys.stdout
+            try:
+                if item:
+                    msg, args = item
+                    stream.write((msg % args if args else msg) + '\n')
+                now = time.monotonic()
+                if now >= next_summary:
+                    next_summary = now + self.SUMMARY_INTERVAL
+                    self._write_suppressed(stream)
+                if self._queue.empty():
+                    stream.flush()
+            except (OSError, ValueError):
+                # Keep consuming, or the queue fills and close() waits forever
+                self.write_errors += 1
+        stream = self.stream or sys.stdout
+        try:
+            self._write_suppressed(stream)
+            stream.flush()
+        except (OSError, ValueError):
+            self.write_errors += 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='PacketLog', daemon=True)
+        self._thread.start()
+
+    def close(self):
+        # Writes what is queued and the last summaries, then stops the writer.
+        # The stop marker is put with a timeout so a writer that died cannot
+        # block this forever
+        thread = self._thread
+        if thread is None:
+            return
+        while thread.is_alive():
+            try:
+                self._queue.put(None, timeout=0.1)
+                break
+            except queue.Full:
+                pass
+        thread.join()
+        self._thread = None
+
+class LatestFrames:
+    """Newest raw frame of each type, handed from a reader thread to a consumer without locks"""
+
+    def __init__(self):
+        # slots[ptype] is replaced, never mutated: storing a reference is
+        # atomic, so a reader always sees a whole frame, old or new
+        self.slots = [None] * 256
+        self.counts = [0] * 256
+
+    def store(self, ptype, frame):
+        # Reader thread: copy out of the deframer buffer, nothing decoded
+        self.slots[ptype] = bytes(frame)
+        self.counts[ptype] += 1
+
+    def get(self, ptype, last=None):
+        # Newest frame of ptype, or None if there is none or it is still
+        # `last`, the frame the caller got before
+        frame = self.slots[ptype]
+        return None if frame is last else frame
+
+class CrsfDispatcher:
+    """Routes frames to per-type handlers through a 256-slot table"""
+
+    def __init__(self, default=None):
+        # Handlers are called as fn(ptype, data); default serves unset types
+        self.default = default if default is not None else ignorePacket
+        self.handlers = [self.default] * 256
+
+    def register_handler(self, ptype, fn):
+        # Returns the handler that was replaced so callers can chain to it
+        previous = self.handlers[ptype]
+        self.handlers[ptype] = fn
+        return previous
+
+    def unregister_handler(self, ptype):
+        self.handlers[ptype] = self.default
+
+    def dispatch(self, ptype, data):
+        return self.handlers[ptype](ptype, data)
+
+def ignorePacket(ptype, data):
+    pass
+
+def handleUnknownPacket(ptype, data):
+    packet_log.log(ptype, logging.INFO, "Unknown 0x%02x: %s", ptype, HexDump(data))
+
+def handleRadioId(ptype, data):
+    if data[5] == 0x10:
+        packet_log.log(ptype, logging.DEBUG, "OTX sync")
+    else:
+        handleUnknownPacket(ptype, data)
+
+def handleLinkStatistics(ptype, data):
+    link = decode_link_statistics(data, latest[ptype])
+    packet_log.log(ptype, logging.DEBUG, "RSSI=%d/%ddBm LQ=%03d mode=%d ant=%d snr=%d power=%d drssi=%d dlq=%d dsnr=%d",
+                   link.rssi1, link.rssi2, link.lq, link.mode, link.antenna, link.snr, link.power,
+                   link.downlink_rssi, link.downlink_lq, link.downlink_snr)
+
+def handleAttitude(ptype, data):
+    att = decode_attitude(data, latest[ptype])
+    packet_log.log(ptype, logging.DEBUG, "Attitude: Pitch=%0.2f Roll=%0.2f Yaw=%0.2f (rad)",
+                   att.pitch, att.roll, att.yaw)
+
+def handleFlightMode(ptype, data):
+    mode = decode_flight_mode(data, latest[ptype])
+    packet_log.log(ptype, logging.DEBUG, "Flight Mode: %s", mode.mode)
+
+def handleBatterySensor(ptype, data):
+    bat = decode_battery_sensor(data, latest[ptype])
+    packet_log.log(ptype, logging.DEBUG, "Battery: %0.2fV %0.1fA %dmAh %d%%",
+                   bat.voltage, bat.current, bat.mah, bat.percent)
+
+def handleBaroAlt(ptype, data):
+    packet_log.log(ptype, logging.DEBUG, "BaroAlt: %s", HexDump(data))
+
+def handleDeviceInfo(ptype, data):
+    packet_log.log(ptype, logging.INFO, "Device Info: %s", HexDump(data))
+
+def handleGps(ptype, data):
+    gps = decode_gps(data, latest[ptype])
+    packet_log.log(ptype, logging.DEBUG, "GPS: Pos=%s %s GSpd=%0.1fm/s Hdg=%0.1f Alt=%dm Sats=%d",
+                   gps.lat, gps.lon, gps.speed, gps.heading, gps.altitude, gps.sats)
+
+def handleVario(ptype, data):
+    vario = decode_vario(data, latest[ptype])
+    packet_log.log(ptype, logging.DEBUG, "VSpd: %0.1fm/s", vario.vspeed)
+
+def handleRcChannels(ptype, data):
+    rc = decode_rc_channels(data, latest[ptype])
+    packet_log.log(ptype, logging.INFO, "Channels: %s", rc.channels)
+
+# Log behind the CLI handlers; adjust per type with set_level/set_rate
+packet_log = PacketLog()
+
+# Most recent record of each decoded type, updated in place by the CLI handlers
+latest = {ptype: record() for ptype, record in RECORD_TYPES.items()}
+
+# Dispatcher behind handleCrsfPacket, preloaded with the CLI handlers
+dispatcher = CrsfDispatcher(default=handleUnknownPacket)
+for _ptype, _handler in (
+        (PacketsTypes.RC_CHANNELS_PACKED, handleRcChannels),
+        (PacketsTypes.LINK_STATISTICS, handleLinkStatistics),
+        (PacketsTypes.ATTITUDE, handleAttitude),
+        (PacketsTypes.FLIGHT_MODE, handleFlightMode),
+        (PacketsTypes.BATTERY_SENSOR, handleBatterySensor),
+        (PacketsTypes.BARO_ALT, handleBaroAlt),
+        (PacketsTypes.DEVICE_INFO, handleDeviceInfo),
+        (PacketsTypes.GPS, handleGps),
+        (PacketsTypes.VARIO, handleVario),
+        (PacketsTypes.RADIO_ID, handleRadioId)):
+    dispatcher.register_handler(_ptype, _handler)
+
+def register_handler(ptype, fn):
+    return dispatcher.register_handler(ptype, fn)
+
+def unregister_handler(ptype):
+    dispatcher.unregister_handler(ptype)
+
+def handleCrsfPacket(ptype, data):
+    packet_log.log(ptype, logging.DEBUG, "Packet Type: 0x%02x", ptype)
+    dispatcher.handlers[ptype](ptype, data)
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('-P', '--port', default='COM4', required=False)
     parser.add_argument('-b', '--baud', default=921600, required=False)
     parser.add_argument('-t', '--tx', required=False, default=True, action='store_true',
-                    help='Enable sending CHANNELS_PACKED every 20ms (all channels 1500us)')
+                    help='Enable sending CHANNELS_PACKED at --rate (all channels 1500us)')
+    parser.add_argument('-R', '--rate', type=int, default=50, choices=TxScheduler.RATES,
+                    help='CHANNELS_PACKED send rate in Hz')
+    parser.add_argument('-v', '--verbose', action='store_true',
+                    help='Log every decoded packet (DEBUG level) for all types')
+    parser.add_argument('-d', '--debug-type', action='append', default=[], type=lambda t: int(t, 0),
+                    help='Log DEBUG lines for this frame type only, e.g. 0x14 (repeatable)')
+    parser.add_argument('-r', '--log-rate', type=int, default=10,
+                    help='Max log lines per second per frame type, 0 for no limit')
+    parser.add_argument('-w', '--record', metavar='FILE',
+                    help='Record received frames to a capture file')
+    parser.add_argument('--record-raw', action='store_true',
+                    help='Record raw serial bytes (before deframing) instead of frames')
+    parser.add_argument('-S', '--stats', action='store_true',
+                    help='Count frames, CRC errors, resyncs and latency; print a summary at exit')
+    parser.add_argument('-m', '--metrics', metavar='[HOST:]PORT',
+                    help='Serve Prometheus metrics on this port (implies --stats)')
+    parser.add_argument('-e', '--export', metavar='PREFIX',
+                    help='Export decoded telemetry, e.g. flight1 -> flight1_GPS.csv')
+    parser.add_argument('--export-format', choices=('csv', 'parquet'), default='csv',
+                    help='Export file format (parquet needs pyarrow)')
+    parser.add_argument('--export-wide', action='store_true',
+                    help='Export one merged table instead of one per frame type')
     args = parser.parse_args()
 
-    with serial.Serial(args.port, args.baud, timeout=2) as ser:
-        input = bytearray()
-        while True:
-            if ser.in_waiting > 0:
-                input.extend(ser.read(ser.in_waiting))
-            else:
-                if args.tx:
-                    ser.write(channelsCrsfToChannelsPacket([992 for ch in range(16)]))
-                time.sleep(0.020)
-
-            while len(input) > 2:
-                # This simple parser works with malformed CRSF streams
-                # it does not check the first byte for SYNC_BYTE, but
-                # instead just looks for anything where the packet length
-                # is 4-64 bytes, and the CRC validates
-                expected_len = input[1] + 2
-                if expected_len > 64 or expected_len < 4:
-                    input = bytearray()
-                elif len(input) >= expected_len:
-                    single = input[:expected_len] # copy out this whole packet
-                    input = input[expected_len:] # and remove it from the buffer
-
-                    if not crsf_validate_frame(single): # single[-1] != crc:
-                        packet = ' '.join(map(hex, single))
-                        # print(f"crc error: {packet}")
-                    else:
-                        handleCrsfPacket(single[2], single)
-                else:
-                    break
\ No newline at end of file
+    recorder = None
+    if args.record:
+        from crsf_capture import CaptureWriter
+        recorder = CaptureWriter(args.record)
+
+    exporter = None
+    if args.export:
+        from crsf_export import TelemetryExporter
+        exporter = TelemetryExporter(args.export, args.export_format, args.export_wide)
+
+    metrics = None
+    if args.metrics:
+        from crsf_metrics import MetricsServer, parse_address
+        metrics = MetricsServer(*parse_address(args.metrics))
+        metrics.start()
+        print(f"Metrics on http://{metrics.host}:{metrics.port}/metrics")
+
+    for ptype in range(256):
+        packet_log.set_rate(ptype, args.log_rate)
+        if args.verbose or ptype in args.debug_type:
+            packet_log.set_level(ptype, logging.DEBUG)
+
+    with serial.Serial(args.port, args.baud, timeout=0.5) as ser:
+        tx = TxScheduler(ser, args.rate)
+        if args.tx:
+            tx.start()
+        deframer = CrsfDeframer(resync=True, stats=ParserStats() if args.stats or metrics else None)
+        record_frames = recorder is not None and not args.record_raw
+        if recorder is not None and args.record_raw:
+            deframer.on_data = recorder.raw_sink()
+        try:
+            while True:
+                deframer.fill(ser, wait=True)
+                for frame in deframer.frames():
+                    if record_frames:
+                        recorder.write_frame(frame)
+                    if exporter is not None:
+                        exporter.submit(frame[2], frame)
+                    handleCrsfPacket(frame[2], frame)
+                if metrics is not None:
+                    metrics.publish(args.port, deframer.stats, latest)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            tx.stop()
+            packet_log.close()
+            if recorder is not None:
+                try:
+                    recorder.close()
+                except OSError as e:
+                    print(f"Recording failed: {e}")
+            if metrics is not None:
+                metrics.stop()
+            if exporter is not None:
+                exporter.close()
+                if exporter.dropped:
+                    print(f"Export dropped {exporter.dropped} frames")
+                if exporter.errors:
+                    print(f"Export failed on {exporter.errors} frames")
+            if args.tx:
+                print("TX {rate_hz:.0f} Hz: sent={sent} missed={missed} period={period_us:.1f}us "
+                      "jitter rms={jitter_rms_us:.1f}us max={jitter_max_us:.1f}us".format(**tx.stats()))
+            if args.stats:
+                snapshot = deframer.stats.snapshot()
+                print("RX frames={frames} bytes={bytes} crc_errors={crc_errors} short={short_frames} "
+                      "discarded={bytes_discarded} resyncs={resyncs} high_water={high_water} "
+                      "latency p50<{latency_p50_us:.0f}us p99<{latency_p99_us:.0f}us".format(**snapshot))
+                print("    " + " ".join(f"{name}={count}" for name, count in snapshot['frames_by_type'].items()))
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+import argparse
+import os
+import select
+import threading
+import time
+import tty
+
+from crsf_capture import CaptureReader, KIND_FRAME, KIND_RAW
+from crsf_parser import CrsfDeframer
+
+__all__ = [
+    'PtyReplay'
+]
+
+class PtyReplay:
+    """Plays a capture into a pty pair; serial.Serial opens the slave side like a real port"""
+
+    def __init__(self, reader, speed=1.0, loop=False, link=None, start_ns=None, chunk=4096):
+        # speed: 1.0 keeps the recorded timing, 10.0 plays ten times faster,
+        # 0 writes as fast as the consumer reads. link: record link number to
+        # play, None for all of them
+        if link is None and len(reader.links) > 1 and any(
+                kind == KIND_RAW for ts, record_link, kind, data in reader.records()):
+            # Raw chunks of several links would interleave mid-frame on the
+            # one pty; whole frames from several links are fine
+            raise ValueError(f"{reader.path} has raw data from {len(reader.links)} links; pick one to replay")
+        self.reader = reader
+        self.speed = speed
+        self.loop = loop
+        self.link = link
+        self.start_ns = start_ns
+        self.chunk = chunk
+        self.master, self.slave = os.openpty()
+        # Raw mode, or the line discipline rewrites 0x0a/0x0d and eats ^C/^S
+        tty.setraw(self.slave)
+        # Non-blocking so stop() is never stuck behind a consumer that
+        # stopped reading
+        os.set_blocking(self.master, False)
+        self.port = os.ttyname(self.slave)
+        self.running = False
+        self.reset_stats()
+        self._thread = None
+        self._drain_thread = None
+
+    def reset_stats(self):
+        self.frames = 0
+        self.bytes = 0
+        self.rx_bytes = 0
+        self.passes = 0
+        self._t0 = time.perf_counter_ns()
+        self._t1 = None
+
+    def stats(self) -> dict:
+        # Measured up to the end of playback once it has finished
+        elapsed = ((self._t1 or time.perf_counter_ns()) - self._t0) / 1e9
+        return {
+            'frames': self.frames,
+            'bytes': self.bytes,
+            'rx_bytes': self.rx_bytes,
+            'passes': self.passes,
+            'elapsed_s': elapsed,
+            'frames_per_sec': self.frames / elapsed if elapsed else 0.0,
+            'bytes_per_sec': self.bytes / elapsed if elapsed else 0.0,
+        }
+
+    def _write(self, data):
+        view = memoryview(data)
+        while view and self.running:
+            # Waits once the pty buffer is full, so "as fast as possible"
+            # runs at the speed of the reader on the slave side
+            try:
+                view = view[os.write(self.master, view):]
+            except BlockingIOError:
+                select.select([], [self.master], [], 0.1)
+
+    def _drain(self):
+        # Whatever the consumer writes (RC channels from the TX thread) must
+        # be read, or its writes block once the pty buffer fills
+        while self.running:
+            readable, _, _ = select.select([self.master], [], [], 0.1)
+            if not readable:
+                continue
+            try:
+                self.rx_bytes += len(os.read(self.master, 4096))
+            except BlockingIOError:
+                pass
+            except OSError:
+                return
+
+    def _play(self):
+        reader = self.reader
+        speed = self.speed
+        link = self.link
+        chunk = self.chunk
+        start = 0 if self.start_ns is None else reader.seek(self.start_ns)
+        pending = bytearray()
+        # Raw records are deframed per link, only to count the frames in them
+        deframers = {}
+        first = None
+        t0 = time.perf_counter_ns()
+        for ts, record_link, kind, data in reader.records(start):
+            if not self.running:
+                break
+            if link is not None and record_link != link:
+                continue
+            if speed:
+                if first is None:
+                    first = ts
+                delay = t0 + (ts - first) / speed - time.perf_counter_ns()
+                if delay > 0:
+                    if pending:
+                        self._write(pending)
+                        pending.clear()
+                    time.sleep(delay / 1e9)
+            pending += data
+            self.bytes += len(data)
+            if kind == KIND_FRAME:
+                self.frames += 1
+            elif kind == KIND_RAW:
+                deframer = deframers.get(record_link)
+                if deframer is None:
+                    deframer = deframers[record_link] = CrsfDeframer(resync=True)
+                while data:
+                    data = data[deframer.feed(data):]
+                    for frame in deframer.frames():
+                        self.frames += 1
+            if len(pending) >= chunk:
+                self._write(pending)
+                pending.clear()
+        if pending:
+            self._write(pending)
+        self.passes += 1
+
+    def run(self):
+        self.running = True
+        self._t1 = None
+        self._drain_thread = threading.Thread(target=self._drain, name='PtyReplay-drain', daemon=True)
+        self._drain_thread.start()
+        while self.running:
+            self._play()
+            if not self.loop:
+                break
+        self._t1 = time.perf_counter_ns()
+        self.running = False
+        self._drain_thread.join()
+        self._drain_thread = None
+
+    def start(self):
+        self.running = True
+        self._thread = threading.Thread(target=self.run, name='PtyReplay', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.running = False
+        for thread in (self._thread, self._drain_thread):
+            if thread is not None:
+                thread.join()
+        self._thread = self._drain_thread = None
+
+    def is_alive(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def close(self):
+        self.stop()
+        os.close(self.slave)
+        os.close(self.master)
+
+def find_link(reader, text):
+    # Link by record number or by the id it was recorded under
+    for number, link_id in reader.links.items():
+        if link_id == text:
+            return number
+    return int(text, 0)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('capture', help='Capture file written with --record')
+    parser.add_argument('-x', '--speed', type=float, default=1.0,
+                    help='Playback speed: 1 keeps the recorded timing, 10 is ten times faster, 0 is as fast as possible')
+    parser.add_argument('-l', '--link', default=None,
+                    help='Only play this link (id or record number)')
+    parser.add_argument('-s', '--start', type=float, default=None,
+                    help='Seconds from the start of the capture to begin at')
+    parser.add_argument('--loop', action='store_true',
+                    help='Start over at the end of the capture')
+    parser.add_argument('--symlink', metavar='PATH',
+                    help='Also expose the pty slave under this path, e.g. /tmp/ttyCRSF')
+    parser.add_argument('--no-wait', action='store_true',
+                    help='Start playing immediately instead of waiting for Enter')
+    args = parser.parse_args()
+
+    with CaptureReader(args.capture) as reader:
+        span = reader.time_range()
+        start_ns = None
+        if args.start is not None and span is not None:
+            start_ns = span[0] + int(args.start * 1e9)
+        link = None if args.link is None else find_link(reader, args.link)
+        try:
+            replay = PtyReplay(reader, args.speed, args.loop, link, start_ns)
+        except ValueError as e:
+            parser.error(f"{e} with --link")
+        port = replay.port
+        if args.symlink:
+            if os.path.islink(args.symlink):
+                os.remove(args.symlink)
+            os.symlink(replay.port, args.symlink)
+            port = args.symlink
+        print(f"Replaying {args.capture} on {port} at "
+              f"{f'{args.speed:g}x' if args.speed else 'max speed'}")
+        # Give the consumer a moment to open the port before data flows
+        if not args.no_wait:
+            input("Open the port, then press Enter to start...")
+        replay.reset_stats()
+        replay.start()
+        try:
+            while replay.is_alive():
+                time.sleep(1.0)
+                s = replay.stats()
+                print(f"{s['frames_per_sec']:.0f} frames/s {s['bytes_per_sec'] / 1024:.1f} KiB/s "
+                      f"frames={s['frames']} rx={s['rx_bytes']}")
+        except KeyboardInterrupt:
+            pass
+        finally:
+            replay.close()
+            if args.symlink:
+                os.remove(args.symlink)
+            s = replay.stats()
+            print(f"{s['frames']} frames, {s['bytes']} bytes in {s['elapsed_s']:.2f} s: "
+                  f"{s['frames_per_sec']:.0f} frames/s, {s['bytes_per_sec'] / 1024:.1f} KiB/s")
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+import math
+from array import array
+from bisect import bisect_left
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from crsf_parser import PacketsTypes, RECORD_TYPES, decode_payload
+
+__all__ = [
+    'STORED_RATES',
+    'SeriesTable',
+    'TelemetryStore'
+]
+
+# Types kept in the store, with the highest rate (Hz) each is expected to
+# arrive at; retention * rate sizes the ring
+STORED_RATES = {
+    PacketsTypes.LINK_STATISTICS: 50,
+    PacketsTypes.ATTITUDE: 100,
+    PacketsTypes.BATTERY_SENSOR: 10,
+    PacketsTypes.GPS: 10,
+    PacketsTypes.VARIO: 50,
+}
+
+class SeriesTable:
+    """Preallocated ring of rows for one frame type: a timestamp column plus one column per record field"""
+
+    def __init__(self, ptype, capacity):
+        self.ptype = ptype
+        self.capacity = capacity
+        self.fields = RECORD_TYPES[ptype].__slots__
+        # NumPy columns when available, else array('q')/array('d'); both
+        # are allocated once and written in place. Each type has its own
+        # timestamp column: types arrive at different rates, and one column
+        # shared by all fields would pad every other field on each row.
+        if np is not None:
+            self.timestamps = np.zeros(capacity, dtype=np.int64)
+            self.columns = {field: np.zeros(capacity, dtype=np.float64) for field in self.fields}
+        else:
+            self.timestamps = array('q', bytes(8 * capacity))
+            self.columns = {field: array('d', bytes(8 * capacity)) for field in self.fields}
+        self._pairs = [(field, self.columns[field]) for field in self.fields]
+        self._record = RECORD_TYPES[ptype]()
+        # Rows ever appended; the ring holds the last `capacity` of them
+        self.count = 0
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def append(self, timestamp_ns, record):
+        # Single writer. The row is filled before count moves, so readers
+        # never see it half written (only the oldest row can be overwritten
+        # under a reader that is copying a full ring)
+        i = self.count % self.capacity
+        self.timestamps[i] = timestamp_ns
+        for field, column in self._pairs:
+            column[i] = getattr(record, field)
+        self.count += 1
+
+    def append_frame(self, timestamp_ns, frame):
+        # Frames too short for the type are skipped
+        record = decode_payload(self.ptype, frame, self._record)
+        if record is not None:
+            self.append(timestamp_ns, record)
+
+    def _column(self, column, first, last):
+        # Rows first..last-1 (absolute row numbers) in order, as a copy
+        n = last - first
+        start = first % self.capacity
+        end = start + n
+        if end <= self.capacity:
+            part = column[start:end]
+            return part.copy() if np is not None else part
+        if np is not None:
+            return np.concatenate((column[start:], column[:end - self.capacity]))
+        return column[start:] + column[:end - self.capacity]
+
+    def _range(self, cursor=None):
+        count = self.count
+        first = max(count - self.capacity, 0 if cursor is None else cursor)
+        return min(first, count), count
+
+    def window(self, start_ns=None, end_ns=None, fields=None) -> dict:
+        # Rows with start_ns <= timestamp < end_ns as {'timestamp': ...,
+        # field: ...} columns (NumPy arrays, or arrays without NumPy)
+        first, last = self._range()
+        timestamps = self._column(self.timestamps, first, last)
+        if np is not None:
+            lo = 0 if start_ns is None else int(np.searchsorted(timestamps, start_ns))
+            hi = len(timestamps) if end_ns is None else int(np.searchsorted(timestamps, end_ns))
+        else:
+            lo = 0 if start_ns is None else bisect_left(timestamps, start_ns)
+            hi = len(timestamps) if end_ns is None else bisect_left(timestamps, end_ns)
+        result = {'timestamp': timestamps[lo:hi]}
+        for field in fields or self.fields:
+            result[field] = self._column(self.columns[field], first + lo, first + hi)
+        return result
+
+    def since(self, cursor, fields=None) -> tuple:
+        # Rows appended after `cursor` (a count returned by an earlier call,
+        # 0 at first) and the new cursor; rows that already fell out of the
+        # ring are skipped
+        first, last = self._range(cursor)
+        result = {'timestamp': self._column(self.timestamps, first, last)}
+        for field in fields or self.fields:
+            result[field] = self._column(self.columns[field], first, last)
+        return result, last
+
+class TelemetryStore:
+    """One SeriesTable per telemetry type, sized from a retention time"""
+
+    def __init__(self, retention=600.0, rates=None):
+        # retention: seconds of history at the expected rates
+        self.retention = retention
+        self.tables = {}
+        # field name -> table; field names are unique across stored types
+        self.fields = {}
+        for ptype, rate in (STORED_RATES if rates is None else rates).items():
+            table = SeriesTable(ptype, max(1, math.ceil(retention * rate)))
+            self.tables[ptype] = table
+            for field in table.fields:
+                self.fields[field] = table
+
+    def append(self, ptype, timestamp_ns, record):
+        table = self.tables.get(ptype)
+        if table is not None:
+            table.append(timestamp_ns, record)
+
+    def append_frame(self, ptype, timestamp_ns, frame):
+        # Decodes and stores a raw frame; other types are ignored
+        table = self.tables.get(ptype)
+        if table is not None:
+            table.append_frame(timestamp_ns, frame)
+
+    def window(self, field, start_ns=None, end_ns=None) -> tuple:
+        # (timestamps, values) of one field
+        columns = self.fields[field].window(start_ns, end_ns, (field,))
+        return columns['timestamp'], columns[field]
+
+    def summary(self, field, start_ns=None, end_ns=None) -> dict:
+        # min/max/mean/last of a field over a window, e.g. for alerting
+        timestamps, values = self.window(field, start_ns, end_ns)
+        if not len(values):
+            return {'count': 0}
+        if np is not None:
+            return {'count': len(values), 'min': float(values.min()), 'max': float(values.max()),
+                    'mean': float(values.mean()), 'last': float(values[-1])}
+        return {'count': len(values), 'min': min(values), 'max': max(values),
+                'mean': sum(values) / len(values), 'last': values[-1]}
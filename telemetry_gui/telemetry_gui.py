@@ -7,44 +7,223 @@ import time
 import argparse
 from collections import deque
 
-# Import from your original script (assuming it's named python_parser.py)
-# If your file has a different name, change this import
-from python_parser import (
-    PacketsTypes, crsf_validate_frame, signed_byte,
-    channelsCrsfToChannelsPacket
+# Import from the parser modules that sit next to this script
+from crsf_capture import CaptureWriter
+from crsf_store import TelemetryStore
+from crsf_parser import (
+    PacketsTypes, CrsfDeframer, CrsfDispatcher, TxScheduler, decode_payload,
+    LinkStatistics, Attitude, FlightMode, BatterySensor, Gps, Vario
 )
 
+class LabelRenderer:
+    """Redraws only the labels whose record changed, at an interval that follows the data rate"""
+
+    def __init__(self, min_interval=0.033, max_interval=0.5):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval = min_interval
+        # key -> (record, [(label, format, last text)])
+        self.bindings = {}
+        # Keys whose record changed since the last pass
+        self.dirty = set()
+        # Objects with a draw() method (StripChart), drawn on every pass
+        self.charts = []
+        self.frames = 0
+        self.updates = 0
+        self.frame_time = 0.0
+        self.frame_time_max = 0.0
+        self._frame_time_total = 0.0
+
+    def bind(self, key, record, label, fmt):
+        # fmt is a str.format template with the record as {0}, e.g. "{0.lq}"
+        self.bindings.setdefault(key, (record, []))[1].append([label, fmt, None])
+        self.dirty.add(key)
+
+    def mark(self, key):
+        self.dirty.add(key)
+
+    def render(self) -> float:
+        # One pass over the dirty keys; returns the delay before the next pass
+        start = time.perf_counter()
+        dirty = self.dirty
+        rendered = 0
+        while dirty:
+            key = dirty.pop()
+            binding = self.bindings.get(key)
+            if binding is None:
+                continue
+            record, fields = binding
+            rendered += 1
+            for field in fields:
+                text = field[1].format(record)
+                if text != field[2]:
+                    field[0].config(text=text)
+                    field[2] = text
+                    self.updates += 1
+        for chart in self.charts:
+            rendered += chart.draw()
+        elapsed = time.perf_counter() - start
+        self.frames += 1
+        self.frame_time = elapsed
+        self._frame_time_total += elapsed
+        if elapsed > self.frame_time_max:
+            self.frame_time_max = elapsed
+        # Fast while data is flowing, backing off when it is not; never let
+        # rendering take more than about a quarter of the time
+        if rendered:
+            interval = self.min_interval
+        else:
+            interval = min(self.interval * 1.5, self.max_interval)
+        self.interval = max(interval, elapsed * 4)
+        return self.interval
+
+    def stats(self) -> dict:
+        # Frame time in ms; resets the averages
+        frames = self.frames
+        stats = {
+            'frames': frames,
+            'updates': self.updates,
+            'frame_ms': self.frame_time * 1e3,
+            'frame_ms_avg': self._frame_time_total / frames * 1e3 if frames else 0.0,
+            'frame_ms_max': self.frame_time_max * 1e3,
+            'interval_ms': self.interval * 1e3,
+        }
+        self.frames = self.updates = 0
+        self._frame_time_total = self.frame_time_max = 0.0
+        return stats
+
+class StripChart:
+    """Scrolling line chart on a Tk canvas, updated by shifting and appending points"""
+
+    def __init__(self, parent, lo, hi, depth=100, width=360, height=70, color="blue"):
+        self.canvas = tk.Canvas(parent, width=width, height=height, background="white",
+                                highlightthickness=1, highlightbackground="grey")
+        self.lo = lo
+        self.hi = hi
+        self.height = height
+        self.color = color
+        # With more history than pixels, each column is drawn as the max and
+        # min of `bucket` samples, so the line never has more points than
+        # about two per pixel
+        self.bucket = -(-depth // width)
+        self.columns = -(-depth // self.bucket)
+        self.points = 1 if self.bucket == 1 else 2
+        self.dx = (width - 1) / max(self.columns - 1, 1)
+        self.line = None
+        self.drawn = 0
+        self.pending = []
+        self._partial = []
+        self._carry = []
+
+    def add(self, value):
+        # Tk thread; drawn on the next draw()
+        self.pending.append(value)
+
+    def extend(self, values):
+        self.pending.extend(values)
+
+    def _y(self, value) -> float:
+        value = min(max(value, self.lo), self.hi)
+        return (self.height - 2) * (self.hi - value) / (self.hi - self.lo) + 1
+
+    def draw(self) -> int:
+        # Drops the oldest columns from the line, shifts the rest left with
+        # one canvas move and appends the new ones; returns columns added
+        new = []
+        for value in self.pending:
+            if self.points == 1:
+                new.append((self._y(value),))
+                continue
+            self._partial.append(value)
+            if len(self._partial) == self.bucket:
+                new.append((self._y(max(self._partial)), self._y(min(self._partial))))
+                self._partial = []
+        self.pending = []
+        new = self._carry + new
+        self._carry = []
+        if self.line is None and len(new) * self.points < 2:
+            # A line needs two points; keep the first column for next time
+            self._carry = new
+            return 0
+        new = new[-self.columns:]
+        drop = max(0, self.drawn + len(new) - self.columns)
+        keep = self.drawn - drop if self.drawn > drop else 0
+        coords = []
+        for k, ys in enumerate(new, keep):
+            x = k * self.dx
+            for y in ys:
+                coords += (x, y)
+        if self.line is None:
+            self.line = self.canvas.create_line(*coords, fill=self.color)
+        elif not keep:
+            self.canvas.coords(self.line, *coords)
+        else:
+            if drop:
+                self.canvas.dchars(self.line, 0, 2 * self.points * drop - 1)
+                self.canvas.move(self.line, -drop * self.dx, 0)
+            self.canvas.insert(self.line, "end", coords)
+        self.drawn = keep + len(new)
+        return len(new)
+
 class TelemetryGUI:
-    def __init__(self, root, serial_port, baud_rate, tx_enabled):
+    def __init__(self, root, serial_port, baud_rate, tx_enabled, recorder=None, record_raw=False, history=100,
+                 retention=600.0):
         self.root = root
         self.root.title("ELRS Telemetry Monitor")
-        self.root.geometry("800x600")
+        self.root.geometry("800x720")
         
         self.serial_port = serial_port
         self.baud_rate = baud_rate
         self.tx_enabled = tx_enabled
+        # Optional CaptureWriter; raw records bytes before deframing
+        self.recorder = recorder
+        self.record_raw = record_raw
         
-        # Telemetry data storage
+        # Telemetry data storage, one record per type updated in place; only
+        # the Tk thread touches these
         self.data = {
-            'attitude': {'pitch': 0, 'roll': 0, 'yaw': 0},
-            'flight_mode': 'UNKNOWN',
-            'link_stats': {'rssi1': 0, 'rssi2': 0, 'lq': 0, 'mode': 0},
-            'battery': {'voltage': 0, 'current': 0, 'mah': 0, 'percent': 0},
-            'gps': {'lat': 0, 'lon': 0, 'speed': 0, 'heading': 0, 'altitude': 0, 'sats': 0},
-            'vario': {'vspeed': 0}
+            'attitude': Attitude(),
+            'flight_mode': FlightMode(),
+            'link_stats': LinkStatistics(),
+            'battery': BatterySensor(),
+            'gps': Gps(),
+            'vario': Vario()
         }
         
-        self.rssi_history = deque(maxlen=100)
-        self.lq_history = deque(maxlen=100)
+        # Every telemetry sample for `retention` seconds; the strip charts
+        # show the last `history` RSSI/LQ. The serial thread only queues raw
+        # frames in `pending`; update_ui decodes each one once, into the
+        # record its labels show, and appends that to the store, so the
+        # store is only touched by the Tk thread.
+        self.store = TelemetryStore(retention)
+        # Bounded to what the store holds: anything older would already be
+        # overwritten in the rings if the Tk thread stalled that long
+        self.pending = deque(maxlen=sum(table.capacity for table in self.store.tables.values()))
+        self.history = history
+        self.chart_cursor = 0
+        
+        # ptype -> data key of the record it is decoded into
+        self.keys = {
+            PacketsTypes.LINK_STATISTICS: 'link_stats',
+            PacketsTypes.ATTITUDE: 'attitude',
+            PacketsTypes.FLIGHT_MODE: 'flight_mode',
+            PacketsTypes.BATTERY_SENSOR: 'battery',
+            PacketsTypes.GPS: 'gps',
+            PacketsTypes.VARIO: 'vario',
+        }
         
         self.running = True
+        self.renderer = LabelRenderer()
+        self.register_handlers()
         self.setup_ui()
+        self.bind_labels()
         
         # Start serial reading thread
         self.serial_thread = threading.Thread(target=self.read_serial, daemon=True)
         self.serial_thread.start()
         
         # Start UI update loop
+        self.next_status = time.monotonic() + 1.0
         self.update_ui()
         
     def setup_ui(self):
@@ -118,6 +297,13 @@ class TelemetryGUI:
         self.mode_label = ttk.Label(link_frame, text="0", font=("Arial", 12))
         self.mode_label.grid(row=1, column=1, sticky=tk.W)
         
+        # RSSI and LQ history
+        self.rssi_chart = StripChart(link_frame, -130, 0, self.history, color="blue")
+        self.rssi_chart.canvas.grid(row=2, column=0, columnspan=2, padx=5, pady=5)
+        self.lq_chart = StripChart(link_frame, 0, 100, self.history, color="green")
+        self.lq_chart.canvas.grid(row=2, column=2, columnspan=2, padx=5, pady=5)
+        self.renderer.charts += [self.rssi_chart, self.lq_chart]
+        
         # GPS
         gps_frame = ttk.LabelFrame(main_frame, text="GPS", padding="10")
         gps_frame.grid(row=3, column=0, columnspan=2, sticky=(tk.W, tk.E), padx=5, pady=5)
@@ -156,123 +342,125 @@ class TelemetryGUI:
         self.vspeed_label = ttk.Label(vario_frame, text="0.0 m/s", font=("Arial", 12))
         self.vspeed_label.grid(row=0, column=1, sticky=tk.W)
         
-    def handle_packet(self, ptype, data):
-        """Process CRSF packets and update data dictionary"""
-        if ptype == PacketsTypes.LINK_STATISTICS:
-            rssi1 = signed_byte(data[3])
-            rssi2 = signed_byte(data[4])
-            lq = data[5]
-            mode = data[8]
-            self.data['link_stats'] = {
-                'rssi1': rssi1, 'rssi2': rssi2, 'lq': lq, 'mode': mode
-            }
-            self.rssi_history.append(rssi1)
-            self.lq_history.append(lq)
-            
-        elif ptype == PacketsTypes.ATTITUDE:
-            pitch = int.from_bytes(data[3:5], byteorder='big', signed=True) / 10000.0
-            roll = int.from_bytes(data[5:7], byteorder='big', signed=True) / 10000.0
-            yaw = int.from_bytes(data[7:9], byteorder='big', signed=True) / 10000.0
-            self.data['attitude'] = {'pitch': pitch, 'roll': roll, 'yaw': yaw}
-            
-        elif ptype == PacketsTypes.FLIGHT_MODE:
-            packet = ''.join(map(chr, data[3:-2])).split('\x00')[0].strip()
-            self.data['flight_mode'] = packet
-            
-        elif ptype == PacketsTypes.BATTERY_SENSOR:
-            vbat = int.from_bytes(data[3:5], byteorder='big', signed=True) / 10.0
-            curr = int.from_bytes(data[5:7], byteorder='big', signed=True) / 10.0
-            mah = data[7] << 16 | data[8] << 7 | data[9]
-            pct = data[10]
-            self.data['battery'] = {
-                'voltage': vbat, 'current': curr, 'mah': mah, 'percent': pct
-            }
-            
-        elif ptype == PacketsTypes.GPS:
-            lat = int.from_bytes(data[3:7], byteorder='big', signed=True) / 1e7
-            lon = int.from_bytes(data[7:11], byteorder='big', signed=True) / 1e7
-            gspd = int.from_bytes(data[11:13], byteorder='big', signed=True) / 36.0
-            hdg = int.from_bytes(data[13:15], byteorder='big', signed=True) / 100.0
-            alt = int.from_bytes(data[15:17], byteorder='big', signed=True) - 1000
-            sats = data[17]
-            self.data['gps'] = {
-                'lat': lat, 'lon': lon, 'speed': gspd,
-                'heading': hdg, 'altitude': alt, 'sats': sats
-            }
-            
-        elif ptype == PacketsTypes.VARIO:
-            vspd = int.from_bytes(data[3:5], byteorder='big', signed=True) / 10.0
-            self.data['vario'] = {'vspeed': vspd}
-    
-    def read_serial(self):
-        """Background thread for reading serial data"""
-        try:
-            with serial.Serial(self.serial_port, self.baud_rate, timeout=2) as ser:
-                input_buffer = bytearray()
-                while self.running:
-                    if ser.in_waiting > 0:
-                        input_buffer.extend(ser.read(ser.in_waiting))
-                    else:
-                        if self.tx_enabled:
-                            ser.write(channelsCrsfToChannelsPacket([992 for ch in range(16)]))
-                        time.sleep(0.020)
-                    
-                    while len(input_buffer) > 2:
-                        expected_len = input_buffer[1] + 2
-                        if expected_len > 64 or expected_len < 4:
-                            input_buffer = bytearray()
-                        elif len(input_buffer) >= expected_len:
-                            single = input_buffer[:expected_len]
-                            input_buffer = input_buffer[expected_len:]
-                            
-                            if crsf_validate_frame(single):
-                                self.handle_packet(single[2], single)
-                        else:
-                            break
-        except Exception as e:
-            print(f"Serial error: {e}")
-    
-    def update_ui(self):
-        """Update UI with current telemetry data"""
-        # Attitude
+        # Render time of the UI itself
+        self.ui_status_label = ttk.Label(main_frame, text="", font=("Arial", 8))
+        self.ui_status_label.grid(row=5, column=0, columnspan=2, sticky=tk.E, padx=5)
+        
+    def bind_labels(self):
+        """Attach each label to its record field for the renderer"""
+        bind = self.renderer.bind
         att = self.data['attitude']
-        self.pitch_label.config(text=f"{att['pitch']:0.2f} rad")
-        self.roll_label.config(text=f"{att['roll']:0.2f} rad")
-        self.yaw_label.config(text=f"{att['yaw']:0.2f} rad")
+        bind('attitude', att, self.pitch_label, "{0.pitch:0.2f} rad")
+        bind('attitude', att, self.roll_label, "{0.roll:0.2f} rad")
+        bind('attitude', att, self.yaw_label, "{0.yaw:0.2f} rad")
         
-        # Battery
         bat = self.data['battery']
-        self.voltage_label.config(text=f"{bat['voltage']:0.2f} V")
-        self.current_label.config(text=f"{bat['current']:0.1f} A")
-        self.capacity_label.config(text=f"{bat['mah']} mAh")
-        self.percent_label.config(text=f"{bat['percent']} %")
+        bind('battery', bat, self.voltage_label, "{0.voltage:0.2f} V")
+        bind('battery', bat, self.current_label, "{0.current:0.1f} A")
+        bind('battery', bat, self.capacity_label, "{0.mah} mAh")
+        bind('battery', bat, self.percent_label, "{0.percent} %")
         
-        # Link Stats
         link = self.data['link_stats']
-        self.rssi_label.config(text=f"{link['rssi1']} dBm")
-        self.lq_label.config(text=f"{link['lq']}")
-        self.mode_label.config(text=f"{link['mode']}")
+        bind('link_stats', link, self.rssi_label, "{0.rssi1} dBm")
+        bind('link_stats', link, self.lq_label, "{0.lq}")
+        bind('link_stats', link, self.mode_label, "{0.mode}")
         
-        # Flight Mode
-        self.flight_mode_label.config(text=self.data['flight_mode'])
+        bind('flight_mode', self.data['flight_mode'], self.flight_mode_label, "{0.mode}")
         
-        # GPS
         gps = self.data['gps']
-        self.lat_label.config(text=f"{gps['lat']:.7f}")
-        self.lon_label.config(text=f"{gps['lon']:.7f}")
-        self.speed_label.config(text=f"{gps['speed']:.1f} m/s")
-        self.alt_label.config(text=f"{gps['altitude']} m")
-        self.sats_label.config(text=f"{gps['sats']}")
-        self.heading_label.config(text=f"{gps['heading']:.1f}°")
+        bind('gps', gps, self.lat_label, "{0.lat:.7f}")
+        bind('gps', gps, self.lon_label, "{0.lon:.7f}")
+        bind('gps', gps, self.speed_label, "{0.speed:.1f} m/s")
+        bind('gps', gps, self.alt_label, "{0.altitude} m")
+        bind('gps', gps, self.sats_label, "{0.sats}")
+        bind('gps', gps, self.heading_label, "{0.heading:.1f}°")
         
-        # Vario
-        self.vspeed_label.config(text=f"{self.data['vario']['vspeed']:.1f} m/s")
+        bind('vario', self.data['vario'], self.vspeed_label, "{0.vspeed:.1f} m/s")
+        
+    def register_handlers(self):
+        self.dispatcher = CrsfDispatcher()
+        for ptype in self.keys:
+            self.dispatcher.register_handler(ptype, self.on_telemetry)
         
-        # Schedule next update
-        self.root.after(50, self.update_ui)  # Update every 50ms
+    def on_telemetry(self, ptype, data):
+        # Serial thread: copy out of the deframer buffer, nothing decoded
+        self.pending.append((time.monotonic_ns(), ptype, bytes(data)))
+        
+    def handle_packet(self, ptype, data):
+        """Hand CRSF packets to the UI thread (serial thread)"""
+        self.dispatcher.handlers[ptype](ptype, data)
+    
+    def decode_pending(self):
+        """Decode each frame queued since the last pass once, into its record and the store (Tk thread)"""
+        pending = self.pending
+        keys = self.keys
+        data = self.data
+        append = self.store.append
+        dirty = set()
+        while pending:
+            timestamp_ns, ptype, frame = pending.popleft()
+            key = keys[ptype]
+            # The labels show the last record decoded of each type
+            record = decode_payload(ptype, frame, data[key])
+            if record is not None:
+                append(ptype, timestamp_ns, record)
+                dirty.add(key)
+        for key in dirty:
+            self.renderer.mark(key)
+        
+        # Charts get every sample since the last pass, not just the newest
+        rows, self.chart_cursor = self.store.tables[PacketsTypes.LINK_STATISTICS].since(
+            self.chart_cursor, ('rssi1', 'lq'))
+        self.rssi_chart.extend(rows['rssi1'])
+        self.lq_chart.extend(rows['lq'])
+    
+    def read_serial(self):
+        """Background thread for reading serial data"""
+        try:
+            # Short timeout so the thread notices self.running going False
+            with serial.Serial(self.serial_port, self.baud_rate, timeout=0.1) as ser:
+                tx = TxScheduler(ser)
+                if self.tx_enabled:
+                    tx.start()
+                deframer = CrsfDeframer(resync=True)
+                recorder = self.recorder
+                if recorder is not None and self.record_raw:
+                    deframer.on_data = recorder.raw_sink()
+                    recorder = None
+                try:
+                    while self.running:
+                        deframer.fill(ser, wait=True)
+                        for frame in deframer.frames():
+                            if recorder is not None:
+                                recorder.write_frame(frame)
+                            self.handle_packet(frame[2], frame)
+                finally:
+                    tx.stop()
+        except Exception as e:
+            print(f"Serial error: {e}")
+    
+    def update_ui(self):
+        """Decode new frames, redraw changed labels, then schedule the next pass"""
+        self.decode_pending()
+        interval = self.renderer.render()
+        
+        now = time.monotonic()
+        if now >= self.next_status:
+            self.next_status = now + 1.0
+            self.ui_status_label.config(
+                text="UI {frame_ms_avg:.2f} ms/frame (max {frame_ms_max:.2f}), {frames} frames/s, "
+                     "{updates} label updates/s, every {interval_ms:.0f} ms".format(**self.renderer.stats()))
+        
+        self.root.after(int(interval * 1000), self.update_ui)
     
     def on_closing(self):
         self.running = False
+        if self.recorder is not None:
+            self.serial_thread.join(timeout=1.0)
+            try:
+                self.recorder.close()
+            except OSError as e:
+                print(f"Recording failed: {e}")
         self.root.destroy()
 
 if __name__ == "__main__":
@@ -281,9 +469,19 @@ if __name__ == "__main__":
     parser.add_argument('-b', '--baud', default=921600, required=False)
     parser.add_argument('-t', '--tx', required=False, default=False, action='store_true',
                         help='Enable sending CHANNELS_PACKED every 20ms (all channels 1500us)')
+    parser.add_argument('-w', '--record', metavar='FILE',
+                        help='Record received frames to a capture file')
+    parser.add_argument('--record-raw', action='store_true',
+                        help='Record raw serial bytes (before deframing) instead of frames')
+    parser.add_argument('-H', '--history', type=int, default=100,
+                        help='RSSI/LQ samples shown in the strip charts')
+    parser.add_argument('--retention', type=float, default=600.0,
+                        help='Seconds of telemetry history kept in memory')
     args = parser.parse_args()
     
+    recorder = CaptureWriter(args.record) if args.record else None
     root = tk.Tk()
-    app = TelemetryGUI(root, args.port, args.baud, args.tx)
+    app = TelemetryGUI(root, args.port, args.baud, args.tx, recorder, args.record_raw, args.history,
+                       args.retention)
     root.protocol("WM_DELETE_WINDOW", app.on_closing)
     root.mainloop()
\ No newline at end of file
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+import os
+import tempfile
+import unittest
+
+from crsf_capture import CaptureReader, CaptureWriter
+
+# LINK_STATISTICS frames with a different payload each, CRC not checked here
+FRAMES = [bytes((0xC8, 12, 0x14)) + bytes([i] * 10) + b'\x00' for i in range(10)]
+
+class CaptureRoundTripTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'f.cap')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write(self, base_ns):
+        # One frame every 100 ms from base_ns
+        with CaptureWriter(self.path) as writer:
+            for i, frame in enumerate(FRAMES):
+                writer.write_frame(frame, timestamp_ns=base_ns + i * 100_000_000)
+
+    def test_read_back_and_close(self):
+        self.write(1_000_000_000)
+        reader = CaptureReader(self.path)
+        frames = []
+        for ts, link, frame in reader.frames():
+            frames.append(bytes(frame))
+        self.assertEqual(frames, FRAMES)
+        self.assertEqual(reader.time_range(), (1_000_000_000, 1_900_000_000))
+        window = [bytes(frame) for ts, link, frame in reader.frames(1_200_000_000, 1_500_000_000)]
+        self.assertEqual(window, FRAMES[2:5])
+        # The loop variable is still a view into the mapping
+        self.assertIsInstance(frame, memoryview)
+        reader.close()
+        self.assertEqual(bytes(frame), FRAMES[-1])
+
+    def test_sidecar_of_a_rerecording_is_rebuilt(self):
+        self.write(1_000_000_000)
+        with CaptureReader(self.path) as reader:
+            self.assertEqual(reader.time_range(), (1_000_000_000, 1_900_000_000))
+        self.assertTrue(os.path.exists(self.path + '.idx'))
+        # Same size, different clocks in the header and records
+        self.write(5_000_000_000)
+        with CaptureReader(self.path) as reader:
+            self.assertEqual(reader.time_range(), (5_000_000_000, 5_900_000_000))
+            self.assertEqual(len(list(reader.frames(5_100_000_000, 5_200_000_000))), 1)
+
+if __name__ == '__main__':
+    unittest.main()